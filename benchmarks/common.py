@@ -0,0 +1,70 @@
+"""Shared scaffolding for the benchmarks.
+
+These mirror the test setup (a mock Shotgun and the testing schema), and are
+run directly, e.g.::
+
+    $ python benchmarks/path_cache_connections.py
+
+"""
+
+import contextlib
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+from sgmock import Shotgun, Fixture
+from sgsession import Session
+
+from sgfs import SGFS
+
+
+schema_path = os.path.abspath(os.path.join(__file__, '..', '..', 'tests', 'schema'))
+os.environ['SGFS_SCHEMA'] = schema_path
+os.environ.pop('SGFS_CACHE_NAME', None)
+os.environ.pop('SGFS_DIR_MAP', None)
+
+
+def sandbox(name):
+    return tempfile.mkdtemp(prefix='sgfs-bench.%s.' % name)
+
+
+@contextlib.contextmanager
+def timer(label, count=None):
+    start = time.time()
+    yield
+    elapsed = time.time() - start
+    if count:
+        print '%-40s %8.3fs (%.1f/s)' % (label, elapsed, count / elapsed)
+    else:
+        print '%-40s %8.3fs' % (label, elapsed)
+
+
+def build_project(sequences=2, shots=10, steps=('Anm', 'Comp', 'Light')):
+    """Build a mock project, returning ``(sgfs, project, tasks)``.
+
+    The project folder itself is created and tagged.
+
+    """
+
+    fix = Fixture(Shotgun())
+    session = Session(fix)
+    sgfs = SGFS(root=sandbox('project'), session=session)
+
+    proj = fix.Project('Benchmark %s' % datetime.datetime.now().strftime('%H%M%S%f'))
+    steps = [fix.find_or_create('Step', code=code, short_name=code) for code in steps]
+    tasks = []
+    for seq_i in xrange(sequences):
+        seq = proj.Sequence('S%02d' % seq_i, project=proj)
+        for shot_i in xrange(shots):
+            shot = seq.Shot('S%02d_%03d' % (seq_i, shot_i), project=proj)
+            for step in steps:
+                tasks.append(shot.Task(step['code'] + ' work', step=step, entity=shot, project=proj))
+
+    proj = session.merge(proj)
+    sgfs.create_structure(proj, allow_project=True)
+    tasks = [session.merge(dict(type='Task', id=task['id'])) for task in tasks]
+
+    return sgfs, proj, tasks
+
@@ -0,0 +1,24 @@
+"""How long does it take to create the structure of many shots?
+
+Compares creating everything from one thread against several. The gains
+are mostly in waiting on the filesystem, so they are much larger on a network
+filesystem than a local one.
+
+"""
+
+from common import *
+
+
+def run(jobs):
+
+    sgfs, proj, tasks = build_project(sequences=2, shots=50)
+
+    with timer('create_structure (jobs=%d)' % jobs, len(tasks)):
+        steps = sgfs.create_structure(tasks, jobs=jobs)
+
+    print '    %d steps' % len(steps)
+
+
+if __name__ == '__main__':
+    run(1)
+    run(8)
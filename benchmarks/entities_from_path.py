@@ -0,0 +1,62 @@
+"""How many times does ``entities_from_path`` touch the filesystem?
+
+Counts stats, listings and opens while resolving a path deep within a Task,
+with and without the path cache's reverse lookup. The tag cache is disabled so
+that every tag read is counted (except for a final run with the default tag
+and untagged directory caches), and project roots are found beforehand since
+they are found once per process.
+
+"""
+
+import __builtin__
+import collections
+
+from common import *
+
+
+counts = collections.Counter()
+
+def counting(name, func):
+    def _counting(*args, **kwargs):
+        counts[name] += 1
+        return func(*args, **kwargs)
+    return _counting
+
+os.stat = counting('stat', os.stat)
+os.lstat = counting('lstat', os.lstat)
+os.listdir = counting('listdir', os.listdir)
+__builtin__.open = counting('open', open)
+
+
+def run(use_cache, tag_cache_size=0, repeat=100):
+
+    sgfs = SGFS(root=base_sgfs.root, session=base_sgfs.session, tag_cache_size=tag_cache_size)
+    sgfs.project_roots
+
+    path = os.path.join(sgfs.path_for_entity(tasks[0]), 'maya', 'scenes', 'v0001', 'work')
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    # Untagged directories are only remembered once they are a few seconds old.
+    mtime = time.time() - 60
+    dir_path = path
+    for i in xrange(4):
+        os.utime(dir_path, (mtime, mtime))
+        dir_path = os.path.dirname(dir_path)
+
+    counts.clear()
+    with timer('entities_from_path x%d (use_cache=%s, tag_cache_size=%s)' % (repeat, use_cache, tag_cache_size), repeat):
+        for i in xrange(repeat):
+            entities = sgfs.entities_from_path(path, use_cache=use_cache)
+            context = sgfs.context_from_path(path, use_cache=use_cache)
+    assert list(entities) == [tasks[0]], entities
+
+    print '    per call: %s' % ', '.join('%s=%.1f' % (k, v / (2.0 * repeat)) for k, v in sorted(counts.iteritems()))
+
+
+if __name__ == '__main__':
+    base_sgfs, proj, tasks = build_project(sequences=1, shots=2)
+    base_sgfs.create_structure(tasks)
+    run(use_cache=False)
+    run(use_cache=True)
+    run(use_cache=True, tag_cache_size=None)
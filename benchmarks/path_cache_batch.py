@@ -0,0 +1,42 @@
+"""How long does it take to tag 10k entities, with and without batching?
+
+Each unbatched write is its own transaction (and so at least one fsync),
+while batched writes are committed all at once.
+
+"""
+
+from common import *
+
+
+def run(count=10000):
+
+    sgfs, proj, tasks = build_project(sequences=1, shots=1)
+    root = sgfs.path_for_entity(proj)
+    entities = []
+    for i in xrange(count):
+        entities.append(sgfs.session.create('PublishEvent', dict(code='Publish %d' % i, project=proj)))
+
+    for batch in (False, True):
+
+        # Fresh directories, and a fresh cache to write to.
+        base = os.path.join(root, 'batched' if batch else 'unbatched')
+        paths = [os.path.join(base, str(i)) for i in xrange(count)]
+        for path in paths:
+            os.makedirs(path)
+        cache = sgfs.path_cache(proj, name='600-%s' % ('batched' if batch else 'unbatched'))
+
+        def tag_all():
+            for entity, path in zip(entities, paths):
+                sgfs.tag_directory_with_entity(path, entity, cache=False)
+                cache[entity] = path
+
+        with timer('tag %d entities (batch=%s)' % (count, batch), count):
+            if batch:
+                with cache.batch():
+                    tag_all()
+            else:
+                tag_all()
+
+
+if __name__ == '__main__':
+    run()
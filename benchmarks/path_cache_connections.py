@@ -0,0 +1,30 @@
+"""How many SQLite connections does ``create_structure`` open?
+
+Compares the pooled connections against opening one per operation.
+
+"""
+
+from common import *
+
+from sgfs import cache
+
+
+def run(pooled):
+
+    cache.connection_pool.close()
+    cache.connection_pool.enabled = pooled
+
+    sgfs, proj, tasks = build_project()
+
+    before = cache.connection_pool.open_count
+    with timer('create_structure (pooled=%s)' % pooled, len(tasks)):
+        sgfs.create_structure(tasks)
+    opened = cache.connection_pool.open_count - before
+
+    print '    %d connections opened for %d tasks' % (opened, len(tasks))
+
+
+if __name__ == '__main__':
+    run(pooled=False)
+    run(pooled=True)
+
@@ -0,0 +1,47 @@
+"""How fast are subtree queries on a large path cache?
+
+Fills a cache with 500k rows (100 sequences of 100 shots of 50 tasks) and
+compares the old ``LIKE`` query against the indexed range that
+``walk_directory`` now uses.
+
+"""
+
+from common import *
+
+
+def run(sequences=100, shots=100, tasks=50, repeat=100):
+
+    sgfs, proj, _ = build_project(sequences=1, shots=1)
+    cache = sgfs.path_cache(proj)
+
+    rows = []
+    for seq_i in xrange(sequences):
+        for shot_i in xrange(shots):
+            shot_path = 'SEQ/S%03d/S%03d_%03d' % (seq_i, seq_i, shot_i)
+            rows.append(('Shot', seq_i * shots + shot_i, shot_path))
+            for task_i in xrange(tasks - 1):
+                rows.append(('Task', len(rows), '%s/T%02d' % (shot_path, task_i)))
+    with cache.write_con() as con:
+        con.executemany(cache._insert_query, [cache._insert_params(*row) for row in rows])
+    print '%d rows' % len(rows)
+
+    root = 'SEQ/S050/S050_050'
+    queries = [
+        ('LIKE', 'path LIKE ?', (root + '%', )),
+        ('range', ) + cache._subtree_clause(root),
+    ]
+
+    with cache.write_con() as con:
+        for label, where, params in queries:
+            plan = con.execute('EXPLAIN QUERY PLAN SELECT * FROM entity_paths WHERE ' + where, params).fetchall()
+            print '%-6s %s' % (label, '; '.join(row[-1] for row in plan))
+
+    for label, where, params in queries:
+        with timer('subtree query x%d (%s)' % (repeat, label), repeat):
+            for i in xrange(repeat):
+                found = cache._select('entity_type, entity_id, path', where, params)
+        print '    %d rows found' % len(found)
+
+
+if __name__ == '__main__':
+    run()
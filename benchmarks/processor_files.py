@@ -0,0 +1,44 @@
+"""How long does the Processor take to touch and copy many files?
+
+Compares shelling out to ``touch`` and ``cp -np`` (as it used to) against
+doing it in process.
+
+"""
+
+from common import *
+
+from sgfs.processor import Processor
+
+
+class SubprocessProcessor(Processor):
+
+    def touch(self, path, mode=0666):
+        if self._claim(self.touched_files, path):
+            self.call(['touch', path])
+            os.chmod(path, mode)
+
+    def copy(self, source, dest, mode=0666):
+        if self._claim(self.copied_files, dest):
+            self.call(['cp', '-np', source, dest])
+            os.chmod(dest, mode)
+
+
+def run(label, processor_class, count=5000):
+
+    root = sandbox('processor')
+    source = os.path.join(root, 'source.txt')
+    with open(source, 'w') as fh:
+        fh.write('template\n' * 100)
+
+    processor = processor_class()
+    with timer('%s touch' % label, count):
+        for i in xrange(count):
+            processor.touch(os.path.join(root, 'touch.%d' % i))
+    with timer('%s copy' % label, count):
+        for i in xrange(count):
+            processor.copy(source, os.path.join(root, 'copy.%d' % i))
+
+
+if __name__ == '__main__':
+    run('subprocess', SubprocessProcessor)
+    run('in-process', Processor)
@@ -0,0 +1,50 @@
+"""How fast can we find the project containing a path with many projects?
+
+Tags 1000 project roots, and compares the old linear ``startswith`` scan over
+``project_roots`` against :meth:`SGFS.find_project_root`.
+
+"""
+
+from common import *
+
+
+def linear_scan(sgfs, path):
+    for project_root in sgfs.project_roots.itervalues():
+        if path.startswith(project_root):
+            return project_root
+
+
+def run(projects=1000, repeat=10000):
+
+    fix = Fixture(Shotgun())
+    session = Session(fix)
+    root = sandbox('project_roots')
+    sgfs = SGFS(root=root, session=session)
+
+    with timer('tag %d projects' % projects, projects):
+        for i in xrange(projects):
+            proj = session.merge(fix.Project('Project %04d' % i))
+            path = os.path.join(root, 'Project_%04d' % i)
+            os.makedirs(path)
+            sgfs.tag_directory_with_entity(path, proj, cache=False)
+
+    with timer('project_roots (building index)'):
+        SGFS(root=root, session=session).project_roots
+    sgfs = SGFS(root=root, session=session)
+    with timer('project_roots (from index)'):
+        sgfs.project_roots
+
+    paths = [os.path.join(root, 'Project_%04d' % i, 'SEQ', 'AA', 'AA_001', 'Light') for i in xrange(projects)]
+
+    with timer('linear scan x%d' % repeat, repeat):
+        for i in xrange(repeat):
+            linear_scan(sgfs, paths[i % projects])
+
+    sgfs.find_project_root(paths[0])
+    with timer('find_project_root x%d' % repeat, repeat):
+        for i in xrange(repeat):
+            sgfs.find_project_root(paths[i % projects])
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,58 @@
+"""How does walking a tree for tags scale with threads?
+
+Builds a synthetic deep tree in which one directory in ``tag_every`` is
+tagged, and walks it with :func:`sgfs.walk.walk_directory_tags`. On a local
+disk the listings are cached and this mostly measures overhead; run it with
+``SGFS_BENCH_ROOT`` on a network filesystem to see the latency being hidden.
+
+"""
+
+import datetime
+
+from common import *
+
+from sgfs.tags import dump_tags, file_names
+from sgfs.walk import walk_directory_tags
+
+
+def build_tree(root, depth=5, width=6, tag_every=3):
+
+    tag = {
+        'entity': {'type': 'Task', 'id': 1234, 'content': 'Anm work'},
+        'created_at': datetime.datetime.utcnow(),
+        'path': None,
+    }
+    serialized = dump_tags([tag], 'yml')
+
+    count = [0, 0]
+    def build(path, level):
+        count[0] += 1
+        if count[0] % tag_every == 0:
+            count[1] += 1
+            with open(os.path.join(path, file_names['yml']), 'w') as fh:
+                fh.write(serialized)
+        if level < depth:
+            for i in xrange(width):
+                child = os.path.join(path, 'd%d' % i)
+                os.mkdir(child)
+                build(child, level + 1)
+
+    build(root, 0)
+    return count
+
+
+def run(root, dir_count, tag_count):
+
+    sgfs = SGFS(root=root, session=Session(Shotgun()), tag_cache_size=0)
+
+    for jobs in (1, 2, 4, 8, 16):
+        with timer('walk_directory_tags (jobs=%d)' % jobs, dir_count):
+            found = sum(1 for _ in walk_directory_tags(sgfs, root, jobs=jobs, allow_moves=True))
+        assert found == tag_count, (found, tag_count)
+
+
+if __name__ == '__main__':
+    root = tempfile.mkdtemp(prefix='sgfs-bench.walk.', dir=os.environ.get('SGFS_BENCH_ROOT'))
+    dir_count, tag_count = build_tree(root)
+    print '%d directories, %d tagged' % (dir_count, tag_count)
+    run(root, dir_count, tag_count)
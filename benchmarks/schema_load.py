@@ -0,0 +1,26 @@
+"""How much does getting the schema cost each time we build a structure?
+
+Compares building a fresh :class:`~sgfs.schema.Schema` (and loading all of its
+children) against the shared one from :meth:`~sgfs.schema.Schema.load`.
+
+"""
+
+from common import *
+
+from sgfs.schema import Schema
+
+
+def load_fresh():
+    schema = Schema()
+    list(schema._iter_dependencies())
+
+
+def run(func, label, count=1000):
+    with timer(label, count):
+        for i in xrange(count):
+            func()
+
+
+if __name__ == '__main__':
+    run(load_fresh, 'Schema() and children')
+    run(Schema.load, 'Schema.load()')
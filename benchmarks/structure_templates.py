@@ -0,0 +1,27 @@
+"""How long does it take to build (but not create) the structure of many shots?
+
+Templates are scanned once per :class:`~sgfs.schema.Schema`, so a fresh
+schema scans each of them once per build, and the shared one from
+:meth:`~sgfs.schema.Schema.load` only does so the first time.
+
+"""
+
+from common import *
+
+from sgfs.schema import Schema
+
+
+def run(label, get_schema, sgfs, tasks):
+    with timer(label, len(tasks)):
+        context = sgfs.context_from_entities(tasks)
+        get_schema().build_structure(sgfs, context)
+
+
+if __name__ == '__main__':
+
+    sgfs, proj, tasks = build_project(sequences=4, shots=100)
+
+    run('fresh schema', Schema, sgfs, tasks)
+    Schema.load()
+    run('shared schema (first)', Schema.load, sgfs, tasks)
+    run('shared schema (again)', Schema.load, sgfs, tasks)
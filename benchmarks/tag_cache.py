@@ -0,0 +1,24 @@
+"""How many times are tags parsed during ``create_structure``?
+
+Compares a disabled tag cache against the default one.
+
+"""
+
+from common import *
+
+
+def run(tag_cache_size):
+
+    sgfs, proj, tasks = build_project(sequences=2, shots=20)
+    sgfs = SGFS(root=sgfs.root, session=sgfs.session, tag_cache_size=tag_cache_size)
+
+    with timer('create_structure (tag_cache_size=%d)' % tag_cache_size, len(tasks)):
+        sgfs.create_structure(tasks)
+
+    print '    %d tag files parsed, %d cache hits' % (sgfs.stats['tag_cache.miss'], sgfs.stats['tag_cache.hit'])
+
+
+if __name__ == '__main__':
+    run(0)
+    run(1024)
+
@@ -0,0 +1,96 @@
+"""Parse a corpus of generated tag files with the old and new YAML loaders.
+
+This only needs PyYAML, e.g.::
+
+    $ python benchmarks/tag_yaml.py 2000
+
+"""
+
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.abspath(os.path.join(__file__, '..', '..')))
+from sgfs import tags
+
+
+def make_entity(type_, id_, **fields):
+    entity = {
+        'type': type_,
+        'id': id_,
+        'updated_at': datetime.datetime(2014, 1, 1) + datetime.timedelta(seconds=random.randrange(1e8)),
+    }
+    entity.update(fields)
+    return entity
+
+
+def make_tags(i, count):
+    project = make_entity('Project', 1, name='Benchmark Project')
+    sequence = make_entity('Sequence', 10 + i % 10, code='S%02d' % (i % 10), project=project)
+    shot = make_entity('Shot', 1000 + i, code='S%02d_%03d' % (i % 10, i), sg_sequence=sequence, project=project)
+    step = make_entity('Step', 5, code='Light', short_name='Light')
+    out = []
+    for j in range(count):
+        task = make_entity('Task', 10000 + i * 10 + j, content='Lighting %d' % j, step=step, entity=shot, project=project)
+        out.append({
+            'created_at': datetime.datetime.utcnow(),
+            'entity': task,
+            'path': '/Volumes/VFX/Projects/Benchmark/SEQ/S%02d/S%02d_%03d/Light' % (i % 10, i % 10, i),
+            'path_history': [{
+                'path': '/Volumes/VFX/Projects/Old/SEQ/S%02d_%03d/Light' % (i % 10, i),
+                'updated_at': datetime.datetime.utcnow(),
+            }],
+        })
+    return out
+
+
+def main():
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    root = tempfile.mkdtemp(prefix='sgfs-bench.tag_yaml.')
+    try:
+
+        paths = []
+        for i in range(count):
+            path = os.path.join(root, '%05d.yml' % i)
+            with open(path, 'w') as fh:
+                # What the old code wrote; sometimes re-tagged a few times.
+                fh.write(yaml.dump_all(make_tags(i, 1 + i % 3),
+                    explicit_start=True,
+                    indent=4,
+                    default_flow_style=False,
+                ))
+            paths.append(path)
+
+        corpus = [open(path).read() for path in paths]
+
+        def run(label, load):
+            start = time.time()
+            for serialized in corpus:
+                load(serialized)
+            elapsed = time.time() - start
+            print '%-32s %8.3fs (%.0f files/s)' % (label, elapsed, count / elapsed)
+            return elapsed
+
+        print 'libyaml available:', tags.has_libyaml
+        old = run('yaml.load_all (Loader)', lambda x: list(yaml.load_all(x, Loader=yaml.Loader)))
+        new = run('sgfs.tags.load_yaml_tags', tags.load_yaml_tags)
+        print 'speedup: %.1fx' % (old / new)
+
+        # Make sure they agree.
+        for serialized in corpus[:100]:
+            assert tags.load_yaml_tags(serialized) == list(yaml.load_all(serialized, Loader=yaml.Loader))
+
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
+
@@ -24,6 +24,7 @@ setup(
             'sgfs-relink = sgfs.commands.relink:main',
             'sgfs-update = sgfs.commands.update:main',
             'sgfs-repair = sgfs.commands.repair:main',
+            'sgfs-convert-tags = sgfs.commands.convert_tags:main',
 
             # Opening commands.
             'sgfs-open = sgfs.commands.open:run_open',
@@ -1,63 +1,408 @@
 from subprocess import call
 import collections
+import contextlib
 import errno
 import logging
 import os
+import posixpath
 import sqlite3
+import sys
+import threading
+import time
 
 from sgsession import Entity
 
+from .tags import dump_tags, load_tags
+
 
 log = logging.getLogger(__name__)
 
 
+# Filesystems on which SQLite's WAL mode is safe. It relies upon shared memory
+# between every process that has the database open, so only local filesystems
+# qualify; everything else (including anything we can't identify) gets the
+# rollback journal. WAL mode is also stored in the database itself, so we only
+# ever pick it for caches that we create (see PathCache).
+_local_fs_types = set(('ext2', 'ext3', 'ext4', 'xfs', 'btrfs', 'zfs', 'tmpfs', 'apfs', 'hfs'))
+
+
+def _iter_mounts():
+    """Yield ``(mount_point, fs_type)`` for every mounted filesystem we can see."""
+    if os.path.exists('/proc/mounts'):
+        with open('/proc/mounts') as fh:
+            for line in fh:
+                parts = line.split()
+                if len(parts) >= 3:
+                    yield parts[1].replace('\\040', ' '), parts[2]
+    elif sys.platform == 'darwin':
+        # e.g.: "server:/export on /Volumes/VFX (nfs, asynchronous)"
+        try:
+            out = os.popen('mount').read()
+        except OSError:
+            return
+        for line in out.splitlines():
+            head, _, tail = line.rpartition(' (')
+            _, _, mount_point = head.partition(' on ')
+            if mount_point:
+                yield mount_point, tail.split(',')[0].strip(')')
+
+
+def filesystem_type(path):
+    """Get the type of filesystem that the given path is on, or ``None``."""
+    path = os.path.realpath(path)
+    best = None
+    for mount_point, fs_type in _iter_mounts():
+        if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+            if best is None or len(mount_point) > len(best[0]):
+                best = (mount_point, fs_type)
+    return best[1] if best else None
+
+
+class _Connection(object):
+
+    """A long-lived SQLite connection which is shared between threads.
+
+    Use it as a context manager; it holds a lock for the duration of the block
+    and then commits (or rolls back on error) exactly like a plain
+    :class:`sqlite3.Connection` would.
+
+    """
+
+    def __init__(self, path, closing=False):
+
+        self.path = path
+        self.closing = closing
+        self.pid = os.getpid()
+
+        stat = os.stat(path)
+        self.identity = (stat.st_dev, stat.st_ino)
+
+        self.lock = threading.RLock()
+        self.con = None
+        self.journal_mode = None
+        self._open()
+
+    def _open(self):
+        self.con = sqlite3.connect(self.path, check_same_thread=False)
+        self.con.text_factory = str
+
+        # A cache may be shared with other machines (and older versions of
+        # SQLite), so we leave its journal mode alone unless told otherwise.
+        mode = os.environ.get('SGFS_CACHE_JOURNAL_MODE')
+        if mode:
+            self.set_journal_mode(mode)
+        else:
+            try:
+                self.journal_mode = self.con.execute('PRAGMA journal_mode').fetchone()[0].lower()
+            except sqlite3.DatabaseError:
+                self.journal_mode = None
+
+    def set_journal_mode(self, mode):
+        """Set the journal mode of the database, returning what it now is."""
+
+        with self.lock:
+            if self.con is None:
+                self._open()
+            try:
+                actual = self.con.execute('PRAGMA journal_mode = %s' % mode).fetchone()[0].lower()
+            except sqlite3.DatabaseError as e:
+                log.warning('could not set journal_mode of %s to %s: %s' % (self.path, mode, e))
+                return self.journal_mode
+
+        if actual != mode.lower():
+            log.info('journal_mode of %s is %s (wanted %s)' % (self.path, actual, mode))
+        self.journal_mode = actual
+        return actual
+
+    def is_stale(self):
+        """Has the underlying file been moved or replaced, or have we forked?"""
+        if self.pid != os.getpid():
+            return True
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return True
+        return (stat.st_dev, stat.st_ino) != self.identity
+
+    def close(self):
+        with self.lock:
+            if self.con is not None:
+                self.con.close()
+                self.con = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            # We may have been evicted from the pool (and so closed) while
+            # someone was still holding onto us.
+            if self.con is None:
+                self._open()
+            return self.con.__enter__()
+        except:
+            self.lock.release()
+            raise
+
+    def __exit__(self, *args):
+        try:
+            return self.con.__exit__(*args)
+        finally:
+            self.lock.release()
+            if self.closing:
+                self.close()
+
+
+class _AttachedConnection(_Connection):
+
+    """A connection with several caches attached, so that they may all be
+    queried at once.
+
+    Each cache is attached as ``cache_{i}``; their names are in ``aliases``.
+
+    """
+
+    def __init__(self, paths, closing=False):
+
+        self.path = ':memory:'
+        self.paths = paths
+        self.closing = closing
+        self.pid = os.getpid()
+        self.journal_mode = None
+
+        self.lock = threading.RLock()
+        self.aliases = ['cache_%d' % i for i in xrange(len(paths))]
+        self._open()
+
+    def _open(self):
+        self.con = sqlite3.connect(':memory:', check_same_thread=False)
+        self.con.text_factory = str
+        for path, alias in zip(self.paths, self.aliases):
+            self.con.execute('ATTACH DATABASE ? AS %s' % alias, (path, ))
+
+    def is_stale(self):
+        return self.pid != os.getpid()
+
+
+class ConnectionPool(object):
+
+    """A process-wide set of long-lived SQLite connections, one per file.
+
+    Opening a database is several round trips on a network filesystem, so we
+    only want to do it once. Set :envvar:`SGFS_CACHE_POOL` to ``0`` to open a
+    fresh connection for every operation (the old behaviour).
+
+    Only the most recently used :envvar:`SGFS_CACHE_POOL_SIZE` (default 32)
+    connections are kept open, so that long-running processes don't hold
+    onto every cache they have ever touched.
+
+    """
+
+    def __init__(self, enabled=None, max_size=None):
+        if enabled is None:
+            enabled = os.environ.get('SGFS_CACHE_POOL', '1').lower() not in ('0', 'false', 'no', 'off')
+        if max_size is None:
+            max_size = int(os.environ.get('SGFS_CACHE_POOL_SIZE', 32))
+        self.enabled = enabled
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._connections = collections.OrderedDict()
+
+        #: How many connections have been opened; useful for benchmarking.
+        self.open_count = 0
+
+    def connect(self, path):
+        """Get a :class:`_Connection` for the given SQLite file."""
+
+        path = os.path.abspath(path)
+        evicted = []
+
+        with self._lock:
+
+            con = self._connections.pop(path, None) if self.enabled else None
+            if con is not None and con.pid != os.getpid():
+                con = None
+
+            if con is None:
+                con = _Connection(path, closing=not self.enabled)
+                self.open_count += 1
+
+            if self.enabled:
+                self._connections[path] = con
+                while len(self._connections) > max(1, self.max_size):
+                    evicted.append(self._connections.popitem(last=False)[1])
+
+        # Closing waits for anyone using them, so we do it outside of our lock.
+        for old in evicted:
+            if old.pid == os.getpid():
+                old.close()
+
+        return con
+
+    def attach(self, paths):
+        """Get a new :class:`_AttachedConnection` to the given SQLite files.
+
+        These are not shared via the pool, since the set of files to attach
+        is specific to the caller.
+
+        """
+        con = _AttachedConnection([os.path.abspath(x) for x in paths], closing=not self.enabled)
+        with self._lock:
+            self.open_count += 1
+        return con
+
+    def validate(self, path):
+        """Drop our connection to the given file if it has been moved or replaced."""
+
+        path = os.path.abspath(path)
+
+        with self._lock:
+            con = self._connections.get(path)
+            if con is not None and con.is_stale():
+                del self._connections[path]
+                if con.pid == os.getpid():
+                    con.close()
+
+    def close(self):
+        with self._lock:
+            connections = self._connections.values()
+            self._connections.clear()
+        for con in connections:
+            if con.pid == os.getpid():
+                con.close()
+
+
+#: The :class:`ConnectionPool` used by all :class:`PathCache` instances.
+connection_pool = ConnectionPool()
+
+
+def parse_verify_policy(value):
+    """Parse when to verify that cached paths are still tagged.
+
+    :param value: ``"always"``, ``"never"``, or a number of seconds to trust a
+        previous verification for (which may be a string, e.g. from
+        :envvar:`SGFS_VERIFY_TAGS`).
+    :returns: The number of seconds; ``0`` for always, and ``None`` for never.
+    :raises ValueError: when the value is none of the above.
+
+    """
+    if isinstance(value, basestring):
+        lower = value.strip().lower()
+        if lower == 'always':
+            return 0
+        if lower == 'never':
+            return None
+    try:
+        max_age = float(value)
+    except (TypeError, ValueError):
+        max_age = -1
+    if max_age < 0:
+        raise ValueError('tag verification must be "always", "never", or a number of seconds; got %r' % value)
+    return max_age
+
+
+def _parent_and_depth(path):
+    """Get the parent and depth to store alongside a cached path.
+
+    Paths within the project are relative to it (the project itself being
+    ``"."``), and those outside it are absolute.
+
+    """
+    if path == '.':
+        return None, 0
+    path = path.rstrip('/')
+    parent = posixpath.dirname(path) or '.'
+    return parent, len([x for x in path.split('/') if x])
+
+
+#: The suffix of caches in the current format. Older caches (``{name}.sqlite``)
+#: only have the first three columns, and are still read (and written by older
+#: versions of SGFS), so we never modify them; we write to our own file instead.
+_current_suffix = '.v2.sqlite'
+
+
+def _is_current(path):
+    return path.endswith(_current_suffix)
+
+
+def _read_priority(path):
+    # Caches are read in order of their names, but a current cache comes before
+    # an older one of the same name, since we have replaced it.
+    if _is_current(path):
+        return path[:-len(_current_suffix)] + '.sqlite', 0
+    return path, 1
+
+
+def _index_paths(path):
+    """Add the path index to an older cache, returning if it has one.
+
+    Older versions of SGFS don't mind the extra index, but the cache may not
+    be writable by us.
+
+    """
+    con = sqlite3.connect(path)
+    try:
+        with con:
+            con.execute('CREATE INDEX IF NOT EXISTS entity_paths_path ON entity_paths(path)')
+        return True
+    except sqlite3.DatabaseError as e:
+        log.debug('could not index paths in %s: %s' % (path, e))
+        return False
+    finally:
+        con.close()
+
+
 class PathCache(collections.MutableMapping):
     
+    """A mapping from entities to the paths they are tagged at.
+
+    :param sgfs: The owning :class:`~sgfs.sgfs.SGFS`.
+    :param str project_root: The project this cache is for.
+    :param str name: The name of the cache to write to. Defaults to
+        :envvar:`SGFS_CACHE_NAME`, or ``"500-primary"``.
+    :param str read_mode: How to query the caches we read from; ``"attach"``
+        will attach them all to a single connection and answer lookups with a
+        single query, while ``"each"`` will query them one at a time. Defaults
+        to :envvar:`SGFS_CACHE_READ_MODE`, or ``"attach"``.
+
+    """
+
     default_name = '500-primary'
+    default_read_mode = 'attach'
+
+    # SQLite is usually compiled to only allow 10 attached databases, and
+    # 999 parameters per statement.
+    max_attached = 10
+    max_params = 999
 
-    def __init__(self, sgfs, project_root, name=None):
+    _insert_query = '''
+        INSERT OR REPLACE INTO entity_paths
+            (entity_type, entity_id, path, parent, depth, tag, tag_fingerprint, tag_complete)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+
+    def __init__(self, sgfs, project_root, name=None, read_mode=None):
         
         self.sgfs = sgfs
         self.dir_map = sgfs.dir_map
         self.project_root = os.path.abspath(project_root)
+
+        self.read_mode = read_mode or os.environ.get('SGFS_CACHE_READ_MODE', self.default_read_mode)
+        if self.read_mode not in ('attach', 'each'):
+            raise ValueError('read_mode must be "attach" or "each"; got %r' % self.read_mode)
         
         # In the beginning, the cache was a single SQLite file called ``.sgfs-cache.sqlite``,
-        # and then it was moved to ``.sgfs/cache.sqlite``. Finally, we started
+        # and then it was moved to ``.sgfs/cache.sqlite``. Then, we started
         # supporting multiple named caches with ``.sgfs/cache/{name}.sqlite``.
+        # Finally, those gained more columns in ``.sgfs/cache/{name}.v2.sqlite``.
         # We will read from them all, and write to one.
 
-        cache_dir = os.path.join(project_root, '.sgfs', 'caches')
+        self.cache_dir = cache_dir = os.path.join(project_root, '.sgfs', 'caches')
 
         self.write_name = name or os.environ.get('SGFS_CACHE_NAME', self.default_name)
-        self.write_path = os.path.join(cache_dir, self.write_name + '.sqlite')
-        read_paths = [self.write_path]
-
-        # Check for old caches.
-        for name in ('.sgfs-cache.sqlite', '.sgfs/cache.sqlite'):
-            path = os.path.join(project_root, name)
-            if os.path.exists(path):
-                read_paths.append(path)
-
-        # Find all caches.
-        try:
-            names = os.listdir(cache_dir)
-        except OSError as e:
-            if e.errno != errno.ENOENT:
-                raise
-            names = []
-        for name in names:
-            if name.startswith('.'):
-                continue
-            if not name.endswith('.sqlite'):
-                continue
-            read_paths.append(os.path.join(cache_dir, name))
-
-        # We sort them so that they are always in a predictable order regardless
-        # of which is the writer and the behaviour of the filesystem.
-        self.read_paths = sorted(set(read_paths))
+        self.write_path = os.path.join(cache_dir, self.write_name + _current_suffix)
 
         # If it doesn't exist then touch it with read/write permissions for all.
-        if not os.path.exists(self.write_path):
+        created = not os.path.exists(self.write_path)
+        if created:
             db_dir = os.path.dirname(self.write_path)
             umask = os.umask(0)
             try:
@@ -72,31 +417,269 @@ class PathCache(collections.MutableMapping):
                 os.umask(umask)
         
         with self.write_con() as con:
-            con.execute('CREATE TABLE IF NOT EXISTS entity_paths (entity_type TEXT, entity_id INTEGER, path TEXT)')
+            con.execute('''CREATE TABLE IF NOT EXISTS entity_paths (
+                entity_type TEXT,
+                entity_id INTEGER,
+                path TEXT,
+                parent TEXT,
+                depth INTEGER,
+                tag TEXT,
+                tag_fingerprint TEXT,
+                tag_complete INTEGER
+            )''')
             con.execute('CREATE UNIQUE INDEX IF NOT EXISTS entity_paths_entity ON entity_paths(entity_type, entity_id)')
-    
+            con.execute('CREATE INDEX IF NOT EXISTS entity_paths_path ON entity_paths(path)')
+            con.execute('CREATE INDEX IF NOT EXISTS entity_paths_parent ON entity_paths(parent)')
+
+        # Only a cache we just created on a local filesystem gets WAL mode,
+        # since that sticks to the database for everyone who opens it.
+        if created and not os.environ.get('SGFS_CACHE_JOURNAL_MODE') and filesystem_type(self.write_path) in _local_fs_types:
+            self.write_con().set_journal_mode('wal')
+
+        self._attached_cons = None
+
+        # Which of the caches we read from have the path index.
+        self._path_indexed = {}
+
+        self._find_read_paths()
+
+        # Writes collected by batch(), per thread.
+        self._batch_local = threading.local()
+
+    def _list_cache_dir(self):
+        """Get ``(mtime, names)`` of the caches directory, where ``names`` is a
+        ``frozenset`` of the caches within it."""
+
+        # We grab the mtime first so that any cache created while we are
+        # listing will trigger another listing later.
+        try:
+            mtime = os.stat(self.cache_dir).st_mtime
+            names = os.listdir(self.cache_dir)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None, frozenset()
+
+        return mtime, frozenset(name for name in names if not name.startswith('.') and name.endswith('.sqlite'))
+
+    def _find_read_paths(self, listing=None):
+
+        self._cache_dir_mtime, self._cache_names = listing or self._list_cache_dir()
+
+        read_paths = [self.write_path]
+
+        # Check for old caches.
+        for name in ('.sgfs-cache.sqlite', '.sgfs/cache.sqlite'):
+            path = os.path.join(self.project_root, name)
+            if os.path.exists(path):
+                read_paths.append(path)
+
+        # Find all caches.
+        for name in self._cache_names:
+            read_paths.append(os.path.join(self.cache_dir, name))
+
+        # We sort them so that they are always in a predictable order regardless
+        # of which is the writer and the behaviour of the filesystem.
+        self.read_paths = sorted(set(read_paths), key=_read_priority)
+
+        # Subtree walks and reverse lookups rely upon the path index, which
+        # caches written by older versions may not have. We add it (once) if
+        # we can.
+        for path in self.read_paths:
+            if path not in self._path_indexed:
+                self._path_indexed[path] = _is_current(path) or _index_paths(path)
+
+        # We only check that the files are still the ones we have connections
+        # to when listing, since that is when we are touching them anyways.
+        for path in self.read_paths:
+            connection_pool.validate(path)
+
+        # Attach them all again next time we need them.
+        self._attached_cons = None
+
+    def _refresh_read_paths(self):
+        """Find read caches again if any have been created or removed since we
+        last looked.
+
+        In a rollback journal mode every write to any cache creates and
+        deletes a journal beside it, which changes the mtime of the directory,
+        so we only start over when the caches themselves have changed.
+
+        """
+        try:
+            mtime = os.stat(self.cache_dir).st_mtime
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            mtime = None
+        if mtime == self._cache_dir_mtime:
+            return
+        listing = self._list_cache_dir()
+        if listing[1] == self._cache_names:
+            self._cache_dir_mtime = listing[0]
+        else:
+            self._find_read_paths(listing)
+
     def _connect(self, path):
-        con = sqlite3.connect(path)
-        con.text_factory = str
-        return con
+        return connection_pool.connect(path)
 
     def write_con(self):
+        """Get the (shared) connection to the cache we write to.
+
+        Use it as a context manager to lock and get the real connection, e.g.::
+
+            >>> with cache.write_con() as con:
+            ...     con.execute('SELECT COUNT(1) FROM entity_paths')
+
+        """
         return self._connect(self.write_path)
 
     def read_cons(self):
+        """Iterate over (shared) connections to every cache we read from."""
         for path in self.read_paths:
             yield self._connect(path)
 
+    def attached_cons(self):
+        """Get connections with every cache we read from attached to them.
+
+        There will usually be only one, unless there are more caches than
+        SQLite can attach to a single connection.
+
+        """
+        cons = self._attached_cons
+        if cons is None or cons[0].closing or cons[0].is_stale():
+            paths = self.read_paths
+            cons = [
+                connection_pool.attach(paths[i:i + self.max_attached])
+                for i in xrange(0, len(paths), self.max_attached)
+            ]
+            self._attached_cons = cons
+        return cons
+
+    def _select(self, columns, where='1', params=(), ordered=True, fallback=None, fallback_columns=None, sources=False, indexed=False):
+        """Select from the ``entity_paths`` table of every cache we read from.
+
+        :param str columns: The columns to select.
+        :param str where: The ``WHERE`` clause.
+        :param tuple params: Parameters for the ``WHERE`` clause.
+        :param bool ordered: Should the rows be in the order of the caches
+            they came from? Must be ``False`` for aggregates.
+        :param tuple fallback: ``(where, params)`` to use instead for caches
+            in the older format; required if ``where`` uses any columns that
+            they do not have.
+        :param str fallback_columns: The columns to select instead from caches
+            in the older format; e.g. ``NULL`` for missing ones.
+        :param bool sources: Prefix every row with the path of the cache it
+            came from? Requires ``ordered``.
+        :param bool indexed: Only select from caches with the path index?
+        :returns: ``list`` of rows.
+
+        """
+
+        self._refresh_read_paths()
+
+        if ordered:
+            columns = '%s, %%d AS _priority, rowid AS _rowid' % columns
+
+        if fallback_columns is not None and ordered:
+            fallback_columns = '%s, %%d AS _priority, rowid AS _rowid' % fallback_columns
+
+        def build(path, alias, priority):
+            part_columns = columns
+            part_where, part_params = (where, params)
+            if not _is_current(path):
+                if fallback is not None:
+                    part_where, part_params = fallback
+                if fallback_columns is not None:
+                    part_columns = fallback_columns
+            part = 'SELECT %s FROM %s.entity_paths WHERE %s' % (part_columns % priority if ordered else part_columns, alias, part_where)
+            return part, tuple(part_params)
+
+        rows = []
+        priority = 0
+        paths = []
+
+        if self.read_mode == 'attach':
+            for shared in self.attached_cons():
+                parts = []
+                all_params = []
+                for path, alias in zip(shared.paths, shared.aliases):
+                    if indexed and not self._path_indexed.get(path):
+                        priority += 1
+                        paths.append(path)
+                        continue
+                    part, part_params = build(path, alias, priority)
+                    parts.append(part)
+                    all_params.extend(part_params)
+                    paths.append(path)
+                    priority += 1
+                if not parts:
+                    continue
+                union = ' UNION ALL '.join(parts)
+                if ordered:
+                    union += ' ORDER BY _priority, _rowid'
+                with shared as con:
+                    rows.extend(con.execute(union, all_params).fetchall())
+
+        else:
+            for shared in self.read_cons():
+                if indexed and not self._path_indexed.get(shared.path):
+                    paths.append(shared.path)
+                    priority += 1
+                    continue
+                part, part_params = build(shared.path, 'main', priority)
+                if ordered:
+                    part += ' ORDER BY _rowid'
+                paths.append(shared.path)
+                priority += 1
+                with shared as con:
+                    rows.extend(con.execute(part, part_params).fetchall())
+
+        if sources:
+            rows = [(paths[row[-2]], ) + row[:-2] for row in rows]
+        elif ordered:
+            rows = [row[:-2] for row in rows]
+        return rows
+
+    def _replaced_keys(self, rows):
+        """Get ``(path, type, id)`` for the given rows (with sources) which are
+        from an older cache, and whose entity is also in the current cache
+        that replaced it.
+
+        Those rows are stale, since we only write to the current cache.
+
+        """
+
+        keys_by_current = {}
+        for row in rows:
+            path = row[0]
+            if _is_current(path):
+                continue
+            current = path[:-len('.sqlite')] + _current_suffix
+            if current in self.read_paths:
+                keys_by_current.setdefault((current, path), set()).add((row[1], row[2]))
+
+        replaced = set()
+        for (current, path), keys in keys_by_current.iteritems():
+            ids_by_type = {}
+            for type_, id_ in keys:
+                ids_by_type.setdefault(type_, []).append(id_)
+            with self._connect(current) as con:
+                for type_, ids in sorted(ids_by_type.iteritems()):
+                    for i in xrange(0, len(ids), self.max_params - 1):
+                        chunk = ids[i:i + self.max_params - 1]
+                        replaced.update((path, type_, id_) for id_, in con.execute(
+                            'SELECT entity_id FROM entity_paths WHERE entity_type = ? AND entity_id IN (%s)' % ', '.join('?' * len(chunk)),
+                            [type_] + chunk,
+                        ))
+        return replaced
+
     def __repr__(self):
         return '<%s for %r at 0x%x>' % (self.__class__.__name__, self.project_root, id(self))
     
-    def __setitem__(self, entity, path):
-        
-        if not isinstance(entity, Entity):
-            raise TypeError('path cache keys must be entities; got %r %r' % (type(entity), entity))
-        if not isinstance(path, basestring):
-            raise TypeError('path cache values must be basestring; got %r %r' % (type(path), path))
-        
+    def _to_cached_path(self, path):
+        """Get the form of the given path that we store; relative to the
+        project if within it, and absolute otherwise."""
 
         path = os.path.abspath(path)
         project_root = self.project_root
@@ -108,9 +691,111 @@ class PathCache(collections.MutableMapping):
             elif path[len(project_root)] == os.path.sep:
                 path = path[len(project_root) + 1:]
 
+        return path
+
+    def __setitem__(self, entity, path):
+        self.set(entity, path)
+
+    def set(self, entity, path, tag=None, fingerprint=None, complete=False):
+        """Cache the path for an entity, and optionally the tag it has there.
+
+        Storing the tag lets :meth:`walk_tags` answer for the tag data without
+        reading the directory. Since the tag files are still the source of
+        truth, it is only trusted while the directory's tags match the given
+        fingerprint.
+
+        :param Entity entity: The entity to cache.
+        :param str path: The directory it is tagged at.
+        :param dict tag: The tag of the entity in that directory.
+        :param str fingerprint: Identifies the state of the directory's tag
+            files that ``tag`` was taken from; see
+            ``SGFS._tag_fingerprint``. This also lets :meth:`get` verify
+            that the entity is still tagged there with a ``stat``.
+        :param bool complete: Are the tags of every entity tagged in the
+            directory (as of ``fingerprint``) being cached at it?
+
+        """
+        
+        if not isinstance(entity, Entity):
+            raise TypeError('path cache keys must be entities; got %r %r' % (type(entity), entity))
+        if not isinstance(path, basestring):
+            raise TypeError('path cache values must be basestring; got %r %r' % (type(path), path))
+
+        path = self._to_cached_path(path)
+
+        if tag is not None:
+            # Stored exactly as a JSON tag file would (with its created_at),
+            # minus any sgsession state.
+            tag = dict(tag)
+            if isinstance(tag['entity'], Entity):
+                tag['entity'] = tag['entity'].as_dict()
+            tag = dump_tags([tag], 'jsonl').strip()
+        else:
+            fingerprint = None
+            complete = False
+
+        value = (path, tag, fingerprint, complete)
+
+        pending = getattr(self._batch_local, 'pending', None)
+        if pending is not None:
+            key = (entity['type'], entity['id'])
+            pending.pop(key, None)
+            pending[key] = value
+            return
+
         with self.write_con() as con:
-            con.execute('INSERT OR REPLACE into entity_paths values (?, ?, ?)', (entity['type'], entity['id'], path))
-    
+            con.execute(self._insert_query, self._insert_params(entity['type'], entity['id'], *value))
+
+    @staticmethod
+    def _insert_params(entity_type, entity_id, path, tag=None, fingerprint=None, complete=False):
+        parent, depth = _parent_and_depth(path)
+        return (entity_type, entity_id, path, parent, depth, tag, fingerprint, int(bool(complete)))
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Collect the writes made by this thread within the block, and commit
+        them in a single transaction at the end of it.
+
+        ::
+
+            >>> with cache.batch():
+            ...     for entity, path in to_cache:
+            ...         cache[entity] = path
+
+        The tags on disk are the source of truth, so if we die before the
+        commit we lose nothing that :meth:`~sgfs.sgfs.SGFS.rebuild_cache` can't
+        recover. For the same reason, the batch is still committed if the
+        block raises an exception. Batches may be nested; only the outermost
+        one commits.
+
+        Pending writes are visible to :meth:`get` and :meth:`get_many`; other
+        reads commit them first.
+
+        """
+
+        local = self._batch_local
+        if getattr(local, 'pending', None) is not None:
+            yield self
+            return
+
+        local.pending = collections.OrderedDict()
+        try:
+            yield self
+        finally:
+            try:
+                self._commit_batch()
+            finally:
+                local.pending = None
+
+    def _commit_batch(self):
+        pending = getattr(self._batch_local, 'pending', None)
+        if not pending:
+            return
+        rows = [self._insert_params(type_, id_, *value) for (type_, id_), value in pending.iteritems()]
+        with self.write_con() as con:
+            con.executemany(self._insert_query, rows)
+        pending.clear()
+
     def get(self, entity, default=None, check_tags=True):
         """Get a path for an entity.
 
@@ -118,49 +803,203 @@ class PathCache(collections.MutableMapping):
         :param default: What to return if the entity is not in the cache;
             defaults to ``None``.
         :param bool check_tags: Should we check for the entity in the directory
-            tags at the cached path before returning it?
+            tags at the cached path before returning it? How often we really
+            do is up to the ``verify_tags`` policy of the
+            :class:`~sgfs.sgfs.SGFS`.
         :returns: The cached path.
 
         """
 
-        if not isinstance(entity, Entity):
-            raise TypeError('path cache keys are entities; got %r %r' % (type(entity), entity))
-
-        path = default
-        for con in self.read_cons():
-            cur = con.execute('''
-                SELECT
-                    path
-                FROM entity_paths
-                WHERE
-                    entity_type = ? AND
-                    entity_id = ?
-                LIMIT 1
-            ''', (entity['type'], entity['id']))
-            row = next(cur, None)
-            if row is None:
-                continue
+        return self.get_many([entity], check_tags=check_tags).get(entity, default)
 
-            # DirMap the external ones, and make the internal ones absolute.
-            path = row[0]
-            if os.path.isabs(path):
-                path = self.dir_map(path)
-            else:
-                # Need to normpath because very old caches might be strange.
-                path = os.path.normpath(os.path.join(self.project_root, path))
-
-            # Make sure that the entity is actually tagged in the given directory.
-            # This guards against moving tagged directories. This does NOT
-            # effectively guard against copied directories.
-            if check_tags and not any(
-                tag['entity'] is entity for tag in self.sgfs.get_directory_entity_tags(path)
-            ):
-                log.warning('%s %d is not tagged at %s' % (
-                    entity['type'], entity['id'], path,
-                ))
-                continue
+    def get_many(self, entities, check_tags=True):
+        """Get paths for many entities at once.
 
-            return path
+        :param list entities: The entities to look up in the path cache.
+        :param bool check_tags: Should we check for the entities in the
+            directory tags at the cached paths before returning them? Each
+            directory is only checked once.
+        :returns: ``dict`` mapping entities to their cached paths; entities
+            which are not in the cache are not included.
+
+        """
+
+        entities = list(entities)
+        for entity in entities:
+            if not isinstance(entity, Entity):
+                raise TypeError('path cache keys are entities; got %r %r' % (type(entity), entity))
+
+        candidates = self._get_candidates(entities)
+
+        checked = {}
+        found = {}
+        for entity in entities:
+
+            for path, fingerprint in candidates.get((entity['type'], entity['id']), ()):
+
+                # Make sure that the entity is actually tagged in the given directory.
+                # This guards against moving tagged directories. This does NOT
+                # effectively guard against copied directories.
+                if check_tags and not self._check_tags(entity, path, fingerprint, checked):
+                    log.warning('%s %d is not tagged at %s' % (
+                        entity['type'], entity['id'], path,
+                    ))
+                    continue
+
+                found[entity] = path
+                break
+
+        return found
+
+    def _get_candidates(self, entities):
+        """Get ``{(type, id): [(path, fingerprint), ...]}`` for the given
+        entities, in order of preference."""
+
+        # Every entity is at most 2 parameters, and they are repeated for every
+        # cache that we are selecting from at once.
+        per_query = 1 if self.read_mode == 'each' else min(len(self.read_paths), self.max_attached)
+        chunk_size = max(1, self.max_params // (2 * per_query))
+
+        # Our own pending writes come first.
+        candidates = {}
+        pending = getattr(self._batch_local, 'pending', None)
+        if pending:
+            for entity in entities:
+                value = pending.get((entity['type'], entity['id']))
+                if value is not None:
+                    candidates[(entity['type'], entity['id'])] = [(self._from_cached_path(value[0]), value[2])]
+
+        for i in xrange(0, len(entities), chunk_size):
+
+            ids_by_type = {}
+            for entity in entities[i:i + chunk_size]:
+                ids_by_type.setdefault(entity['type'], set()).add(entity['id'])
+
+            clauses = []
+            params = []
+            for type_, ids in sorted(ids_by_type.iteritems()):
+                clauses.append('(entity_type = ? AND entity_id IN (%s))' % ', '.join('?' * len(ids)))
+                params.append(type_)
+                params.extend(sorted(ids))
+
+            rows = self._select('entity_type, entity_id, path, tag_fingerprint', ' OR '.join(clauses), params,
+                fallback_columns='entity_type, entity_id, path, NULL')
+            for type_, id_, path, fingerprint in rows:
+                candidates.setdefault((type_, id_), []).append((self._from_cached_path(path), fingerprint))
+
+        return candidates
+
+    def _from_cached_path(self, path):
+        """DirMap the external paths, and make the internal ones absolute."""
+        if os.path.isabs(path):
+            return self.dir_map(path)
+        return os.path.normpath(os.path.join(self.project_root, path))
+
+    def _is_tagged(self, entity, path, fingerprint, checked):
+        """Is the entity tagged at the given path?
+
+        If the tag files have not changed since we cached the entity there
+        (according to the fingerprint), then it must still be, and we don't
+        need to read them to know.
+
+        :param dict checked: What we know of each directory so far, so that
+            each one is only checked once.
+
+        """
+
+        try:
+            current, tagged = checked[path]
+        except KeyError:
+            current, tagged = checked[path] = [repr(self.sgfs._tag_fingerprint(path)), None]
+
+        if fingerprint is not None and fingerprint == current:
+            self.sgfs.stats['path_cache.stat_verified'] += 1
+            return True
+
+        if tagged is None:
+            self.sgfs.stats['path_cache.tag_verified'] += 1
+            tags = self.sgfs.get_directory_entity_tags(path, merge_into_session=False)
+            tagged = checked[path][1] = set((tag['entity']['type'], tag['entity']['id']) for tag in tags)
+        return (entity['type'], entity['id']) in tagged
+
+    def _check_tags(self, entity, path, fingerprint, checked):
+        """:meth:`_is_tagged`, subject to the verification policy of our
+        :class:`~sgfs.sgfs.SGFS` (see its ``verify_tags``)."""
+
+        max_age = self.sgfs.verify_max_age
+        if max_age is None:
+            self.sgfs.stats['path_cache.verify_skipped'] += 1
+            return True
+
+        key = (entity['type'], entity['id'])
+        if max_age:
+            verified_at = self.sgfs._verified_tags.get(path, {}).get(key)
+            if verified_at is not None and time.time() - verified_at < max_age:
+                self.sgfs.stats['path_cache.verify_skipped'] += 1
+                return True
+
+        if not self._is_tagged(entity, path, fingerprint, checked):
+            return False
+
+        if max_age:
+            verified = self.sgfs._verified_tags.get(path)
+            if verified is None:
+                verified = self.sgfs._verified_tags[path] = {}
+            verified[key] = time.time()
+        return True
+
+    def is_tagged_at(self, entity, path):
+        """Is the given entity still tagged at the given path?
+
+        This is answered with a single ``stat`` if the entity is cached at that
+        path and the tags there have not changed since, and by reading the
+        tags otherwise.
+
+        """
+        path = os.path.abspath(path)
+        fingerprint = None
+        for candidate, candidate_fingerprint in self._get_candidates([entity]).get((entity['type'], entity['id']), ()):
+            if candidate == path:
+                fingerprint = candidate_fingerprint
+                break
+        return self._is_tagged(entity, path, fingerprint, {})
+
+    def entities_at_paths(self, paths):
+        """Get the entities cached at any of the given directories.
+
+        This is the reverse of :meth:`get_many`, and is answered from an index
+        without touching the directories themselves. Caches without the path
+        index (i.e. older ones we could not add it to) are not consulted,
+        since they would have to be scanned in full.
+
+        :param list paths: The directories to look up.
+        :returns: ``dict`` mapping the given paths to ``list`` of entities;
+            paths without any cached entities are not included.
+
+        """
+
+        self._commit_batch()
+
+        paths_by_cached = {}
+        for path in paths:
+            paths_by_cached.setdefault(self._to_cached_path(path), []).append(path)
+        cached_paths = sorted(paths_by_cached)
+
+        per_query = 1 if self.read_mode == 'each' else min(len(self.read_paths), self.max_attached)
+        chunk_size = max(1, self.max_params // per_query)
+
+        found = {}
+        for i in xrange(0, len(cached_paths), chunk_size):
+            chunk = cached_paths[i:i + chunk_size]
+            rows = self._select('entity_type, entity_id, path', 'path IN (%s)' % ', '.join('?' * len(chunk)), chunk, indexed=True)
+            for type_, id_, cached_path in rows:
+                entity = self.sgfs.session.merge(dict(type=type_, id=id_))
+                for path in paths_by_cached[cached_path]:
+                    entities = found.setdefault(path, [])
+                    if entity not in entities:
+                        entities.append(entity)
+
+        return found
 
     def __getitem__(self, entity):
         path = self.get(entity)
@@ -172,21 +1011,97 @@ class PathCache(collections.MutableMapping):
     def __delitem__(self, entity):
         if not isinstance(entity, Entity):
             raise TypeError('path cache keys must be entities; got %r %r' % (type(entity), entity))
-        with self.conn:
-            self.conn.execute('DELETE FROM entity_paths WHERE entity_type = ? AND entity_id = ?', (entity['type'], entity['id']))
+        self._commit_batch()
+        # We also forget it from the older cache that ours replaced, which is
+        # otherwise read right after ours.
+        paths = [self.write_path]
+        old_path = os.path.join(self.cache_dir, self.write_name + '.sqlite')
+        if old_path in self.read_paths:
+            paths.append(old_path)
+        for path in paths:
+            with self._connect(path) as con:
+                con.execute('DELETE FROM entity_paths WHERE entity_type = ? AND entity_id = ?', (entity['type'], entity['id']))
     
     def __len__(self):
-        len_ = 0
-        for con in self.read_cons():
-            len_ += next(con.execute('''SELECT COUNT(1) FROM entity_paths'''))[0]
-        return len_
+        # An entity may be in several caches (e.g. ours and the older one it
+        # replaced), but it is only one key.
+        self._commit_batch()
+        return len(set(self._select('entity_type, entity_id', ordered=False)))
     
     def __iter__(self):
-        for con in self.read_cons():
-            for row in con.execute('''SELECT entity_type, entity_id FROM entity_paths'''):
+        self._commit_batch()
+        seen = set()
+        for row in self._select('entity_type, entity_id'):
+            if row not in seen:
+                seen.add(row)
                 yield self.sgfs.session.merge(dict(type=row[0], id=row[1]))
     
-    def walk_directory(self, path, entity_type=None, must_exist=True):
+    def _subtree_clause(self, root_path):
+        """Get a ``WHERE`` clause and params matching a cached path and
+        everything below it.
+
+        This is a range on the path index rather than a ``LIKE``, and stops at
+        a separator so that ``SEQ/GC`` does not match ``SEQ/GC2``.
+
+        """
+        if not root_path:
+            return '1', ()
+        root_path = root_path.rstrip('/')
+        # "0" is the character after "/".
+        return '(path = ? OR (path >= ? AND path < ?))', (root_path, root_path + '/', root_path + '0')
+
+    def _depth_clause(self, root_path, max_depth):
+        """Get a ``WHERE`` clause and params matching a cached path and
+        everything up to ``max_depth`` levels below it."""
+
+        root_path = root_path.rstrip('/') or '.'
+
+        if max_depth == 0:
+            return 'path = ?', (root_path, )
+
+        # Direct children are by far the most common, and the parent index
+        # answers that exactly.
+        if max_depth == 1:
+            return '(path = ? OR parent = ?)', (root_path, root_path)
+
+        max_depth += _parent_and_depth(root_path)[1]
+        if root_path == '.':
+            # Everything relative is within the project.
+            return "(path = ? OR (depth <= ? AND substr(path, 1, 1) != '/'))", (root_path, max_depth)
+        return '(path = ? OR (path >= ? AND path < ? AND depth <= ?))', (root_path, root_path + '/', root_path + '0', max_depth)
+
+    def walk_directory(self, path, entity_type=None, must_exist=True, max_depth=None):
+        """Iterate over the cached entities within the given directory.
+
+        :param str path: The directory to look within.
+        :param str entity_type: Only return entities of this type.
+        :param bool must_exist: Only return paths which exist?
+        :param int max_depth: How many levels below ``path`` to look; ``0`` is
+            just ``path`` itself, and ``1`` is it and its direct children.
+            ``None`` is unlimited.
+        :returns: Iterator of ``(path, entity)``.
+
+        """
+        for path, entity, _, _, _ in self._walk(path, entity_type, must_exist, max_depth, with_tags=False):
+            yield path, entity
+
+    def walk_tags(self, path, entity_type=None, must_exist=True, max_depth=None):
+        """Iterate over the cached entities within the given directory, along
+        with the tags that were cached for them.
+
+        Takes the same arguments as :meth:`walk_directory`.
+
+        :returns: Iterator of ``(path, entity, tag, fingerprint, complete)``,
+            where ``tag`` is the raw tag ``dict`` that was given to :meth:`set`
+            (or ``None``), and the rest are what it was given with. It is up
+            to the caller to decide if the fingerprint is still current.
+
+        """
+        return self._walk(path, entity_type, must_exist, max_depth, with_tags=True)
+
+    def _walk(self, path, entity_type, must_exist, max_depth, with_tags):
+
+        self._commit_batch()
 
         abs_path = os.path.abspath(path)
         root_path = os.path.relpath(abs_path, self.project_root)
@@ -199,17 +1114,52 @@ class PathCache(collections.MutableMapping):
         elif root_path.startswith(os.path.pardir + os.path.sep):
             root_path = abs_path
 
-        for con in self.read_cons():
+        where, params = self._subtree_clause(root_path)
+        fallback = None
+        if max_depth is not None:
+            # Caches in the older format don't know depths, so we look at
+            # their whole subtree and filter it below.
+            fallback = (where, params)
+            where, params = self._depth_clause(root_path, max_depth)
+            max_depth += _parent_and_depth(root_path or '.')[1]
 
-            if entity_type is not None:
-                cur = con.execute('SELECT entity_type, entity_id, path FROM entity_paths WHERE entity_type = ? AND path LIKE ?', (entity_type, root_path + '%'))
-            else:
-                cur = con.execute('SELECT entity_type, entity_id, path FROM entity_paths WHERE path LIKE ?', (root_path + '%', ))
-            
-            for row in cur:
-                entity = self.sgfs.session.merge(dict(type=row[0], id=row[1]))
-                path = os.path.normpath(os.path.join(self.project_root, row[2]))
-                if must_exist and not os.path.exists(path):
-                    continue
-                yield path, entity
+        if entity_type is not None:
+            # The unary "+" stops SQLite from using the entity index instead of
+            # the path ones.
+            where = '+entity_type = ? AND %s' % where
+            params = (entity_type, ) + params
+            if fallback:
+                fallback = ('+entity_type = ? AND %s' % fallback[0], (entity_type, ) + fallback[1])
 
+        if with_tags:
+            rows = self._select('entity_type, entity_id, path, tag, tag_fingerprint, tag_complete', where, params,
+                fallback=fallback, fallback_columns='entity_type, entity_id, path, NULL, NULL, NULL', sources=True)
+        else:
+            rows = self._select('entity_type, entity_id, path', where, params, fallback=fallback, sources=True)
+
+        # Like get(), the first cache an entity is found in wins, and an older
+        # cache is ignored for anything in the one that replaced it (even if
+        # that has it elsewhere).
+        replaced = self._replaced_keys(rows)
+        seen = set()
+
+        for row in rows:
+            if row[:3] in replaced:
+                continue
+            row = row[1:]
+            if (row[0], row[1]) in seen:
+                continue
+            if max_depth is not None:
+                if not root_path and os.path.isabs(row[2]):
+                    continue
+                if _parent_and_depth(row[2])[1] > max_depth:
+                    continue
+            entity = self.sgfs.session.merge(dict(type=row[0], id=row[1]))
+            path = os.path.normpath(os.path.join(self.project_root, row[2]))
+            if must_exist and not os.path.exists(path):
+                continue
+            seen.add((row[0], row[1]))
+            if with_tags and row[3]:
+                yield path, entity, self.dir_map.deep_apply(load_tags(row[3], 'jsonl')[0]), row[4], bool(row[5])
+            else:
+                yield path, entity, None, None, False
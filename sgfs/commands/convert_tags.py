@@ -0,0 +1,85 @@
+import argparse
+import os
+
+from sgfs import SGFS
+from sgfs.tags import dump_tags, formats, file_names, load_tags
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Rewrite directory tags in another format, keeping backups.')
+    parser.add_argument('-f', '--format', choices=formats, default='jsonl')
+    parser.add_argument('-r', '--recurse', action='store_true')
+    parser.add_argument('-n', '--dry-run', action='store_true')
+    parser.add_argument('-v', '--verbose', action='count')
+    parser.add_argument('--no-backup', dest='backup', action='store_false')
+
+    parser.add_argument('roots', nargs='+')
+
+    cmd = parser.parse_args(namespace=ConvertTags())
+    cmd.run()
+
+
+class ConvertTags(object):
+
+    def run(self):
+
+        self.sgfs = SGFS(tag_format=self.format)
+        self.converted = 0
+
+        for root in self.roots:
+
+            root = os.path.abspath(root)
+            if self.recurse:
+                for path, _, _ in os.walk(root):
+                    self.convert_path(path)
+            else:
+                self.convert_path(root)
+
+        print '{} {} directories to {}'.format(
+            'Would convert' if self.dry_run else 'Converted',
+            self.converted,
+            self.format,
+        )
+
+    def read_raw_tags(self, path, formats):
+        # We don't use the SGFS to read them since it would dir-map them.
+        tags = []
+        for format in formats:
+            with open(os.path.join(path, file_names[format])) as fh:
+                tags.extend(load_tags(fh.read(), format))
+        return tags
+
+    def convert_path(self, path):
+
+        present = [x for x in formats if os.path.exists(os.path.join(path, file_names[x]))]
+        if not present or present == [self.format]:
+            return
+
+        tags = self.read_raw_tags(path, present)
+
+        if self.verbose:
+            print path
+            if self.verbose > 1:
+                print '    {} tags from {}'.format(len(tags), ', '.join(file_names[x] for x in present))
+
+        # Make sure that nothing will be lost in translation before touching
+        # anything. Formats differ in incidental ways (e.g. YAML tuples come
+        # back from JSON as lists), so we compare them as they would be
+        # written to JSON.
+        expected = self.normalize(tags)
+        if self.normalize(load_tags(dump_tags(tags, self.format), self.format)) != expected:
+            raise RuntimeError('tags in {} would not survive conversion to {}'.format(path, self.format))
+
+        self.converted += 1
+        if self.dry_run:
+            return
+
+        self.sgfs._write_directory_tags(path, tags, replace=True, backup=self.backup)
+
+        if self.normalize(self.read_raw_tags(path, [self.format])) != expected:
+            raise RuntimeError('tags in {} did not survive conversion to {}; see backups'.format(path, self.format))
+
+    def normalize(self, tags):
+        return dump_tags(tags, 'jsonl')
+
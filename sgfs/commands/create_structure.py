@@ -3,6 +3,7 @@ import sys
 
 from . import Command
 from . import utils
+from ..utils import profile_exprs
 
 
 class CreateStructureCommand(Command):
@@ -18,6 +19,9 @@ class CreateStructureCommand(Command):
         self.add_option('-n', '--dry-run', action='store_true', help='don\'t actually do anything')
         self.add_option('-v', '--verbose', action='count', help='show everything being done', default=0)
         self.add_option('-t', '--types', action="append", dest="entity_types", help="entity types to find if given a path")
+        self.add_option('-j', '--jobs', type="int", default=1,
+            help="create things with this many threads")
+        self.add_option('--profile-exprs', action='store_true', help='print how long the schema expressions took')
         
     def run(self, sgfs, opts, args):
         
@@ -36,7 +40,14 @@ class CreateStructureCommand(Command):
             structure = sgfs.structure_from_entities(entities)
             structure.pprint()
 
-        sgfs.create_structure(entities, dry_run=opts.dry_run, verbose=opts.verbose or opts.dry_run)
+        if not opts.profile_exprs:
+            sgfs.create_structure(entities, dry_run=opts.dry_run, verbose=opts.verbose or opts.dry_run, jobs=opts.jobs)
+            return
+
+        with profile_exprs() as profile:
+            sgfs.create_structure(entities, dry_run=opts.dry_run, verbose=opts.verbose or opts.dry_run, jobs=opts.jobs)
+        for (src, filename), (count, seconds) in sorted(profile.iteritems(), key=lambda x: -x[1][1]):
+            print >> sys.stderr, '%8.3fs %6d %s: %s' % (seconds, count, filename, src.strip().splitlines()[0])
 
 
 main = CreateStructureCommand()
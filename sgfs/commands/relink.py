@@ -16,6 +16,10 @@ class RelinkCommand(Command):
         self.add_option('-r', '--recurse', action="store_true", dest="recurse")
         self.add_option('-u', '--update', action="store_true", dest="update")
         self.add_option('-n', '--dry-run', action="store_true", dest="dry_run")
+        self.add_option('-j', '--jobs', type="int", default=1,
+            help="walk with this many threads when recursing")
+        self.add_option('--no-prune', action="store_false", dest="prune", default=True,
+            help="walk every directory, even those the schema says cannot be tagged")
         
     def run(self, sgfs, opts, args, recurse=False, **kwargs):
     
@@ -28,6 +32,8 @@ class RelinkCommand(Command):
             recurse=recurse or opts.recurse,
             dry_run=opts.dry_run,
             verbose=True,
+            jobs=opts.jobs,
+            prune=opts.prune,
         )
         
         if opts.update and changed:
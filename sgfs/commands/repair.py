@@ -5,6 +5,7 @@ from dirmap import DirMap
 from sgsession.utils import parse_isotime
 
 from sgfs import SGFS
+from sgfs.walk import SchemaPruner, walk_directory_tags
 
 
 def main():
@@ -13,6 +14,8 @@ def main():
     parser.add_argument('-r', '--recurse', action='store_true')
     parser.add_argument('-n', '--dry-run', action='store_true')
     parser.add_argument('-v', '--verbose', action='count')
+    parser.add_argument('--no-prune', action='store_false', dest='prune',
+        help="walk every directory, even those the schema says cannot be tagged")
     
     parser.add_argument('-t', '--parse-times', action='store_true')
     parser.add_argument('-d', '--dirmap', action='append', dest='_dirmap')
@@ -35,16 +38,21 @@ class Repair(object):
     def run(self):
 
         self.dirmap = DirMap(self._dirmap) if self._dirmap else None
+        pruner = SchemaPruner.load(self.sgfs.schema_name) if self.recurse and self.prune else None
 
         for root in self.roots:
 
             root = os.path.abspath(root)
             if self.recurse:
-                for path, _, _ in os.walk(root):
+                walk = walk_directory_tags(self.sgfs, root, prune=pruner, allow_duplicates=True, allow_moves=True)
+                for path in sorted(path for path, _ in walk):
                     self.repair_path(path)
             else:
                 self.repair_path(root)
 
+        if pruner:
+            print 'Pruned {} directories'.format(self.sgfs.stats['walk.pruned'])
+
     def repair_path(self, path):
 
         tags = self.sgfs._read_directory_tags(path)
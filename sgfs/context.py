@@ -36,6 +36,17 @@ class Context(object):
         """Shallow copy the :class:`Context`; children and entities remain references."""
         return copy.copy(self)
     
+    def copy_graph(self):
+        """Copy this node and all of its descendants; entities remain references."""
+        new = self.copy()
+        new.parent = None
+        new.children = []
+        for child in self.children:
+            child = child.copy_graph()
+            child.parent = new
+            new.children.append(child)
+        return new
+    
     def __repr__(self):
         return '<Context %s:%s at 0x%x>' % (self.entity['type'], self.entity['id'], id(self))
     
@@ -1,8 +1,20 @@
 from subprocess import call, list2cmdline
+import errno
 import os
+import shutil
+import threading
 
 
 class Processor(object):
+
+    """Performs (and logs) the filesystem operations for creating a
+    :class:`~sgfs.structure.Structure`.
+
+    Operations may be called from several threads at once (see
+    :meth:`.Structure.create`), in which case they are logged in the order
+    they happen.
+
+    """
     
     def __init__(self, verbose=False, dry_run=False, allow_project=False):
         
@@ -18,15 +30,26 @@ class Processor(object):
         self.touched_files = set()
         self.copied_files = set()
         self.log_events = []
+
+        self._lock = threading.Lock()
     
     def assert_allow_entity(self, entity):
         if entity['type'] in self.disallowed_entities:
             raise ValueError('Not allowed to create %s %d' % (entity['type'], entity['id']))
         
     def log(self, msg):
-        self.log_events.append(msg)
-        if self.verbose:
-            print msg
+        with self._lock:
+            self.log_events.append(msg)
+            if self.verbose:
+                print msg
+
+    def _claim(self, done, path):
+        # Only the first caller for any path gets to act on it.
+        with self._lock:
+            if path in done:
+                return False
+            done.add(path)
+            return True
         
     def comment(self, msg):
         for x in msg.splitlines():
@@ -38,8 +61,7 @@ class Processor(object):
             call(args)
     
     def mkdir(self, path):
-        if path not in self.made_directories:
-            self.made_directories.add(path)
+        if self._claim(self.made_directories, path):
 
             # Seems like our NFS is not always mounting fast enough if we just
             # try to make the folder directly, so I'm going to check for it
@@ -52,28 +74,72 @@ class Processor(object):
             self.log(list2cmdline(['mkdir', '-pm', '0777', path]))
 
             if not self.dry_run:
+                self._makedirs(path)
+
+    def _makedirs(self, path):
+
+        parent = os.path.dirname(path)
+        if parent != path and not os.path.exists(parent):
+            self._makedirs(parent)
 
-                # Be wary of thread-unsafe umask....
-                umask = os.umask(0)
-                try:
-                    os.makedirs(path, 0777)
-                except OSError as e:
-                    if e.errno != 17: # Directory already exists.
-                        raise
-                finally:
-                    os.umask(umask)
+        try:
+            os.mkdir(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            return
+
+        # The umask is process-wide, so we can't clear it while other threads
+        # may be creating things. Open up the permissions afterwards instead
+        # (keeping any setgid bit from the parent).
+        os.chmod(path, os.stat(path).st_mode | 0777)
     
-    def touch(self, path):
-        if path not in self.touched_files:
-            self.touched_files.add(path)
-            self.call(['touch', path])
+    def touch(self, path, mode=0666):
+        """Create an empty file (or update the times of an existing one), and
+        set its mode. Logged as ``touch path``."""
+        if self._claim(self.touched_files, path):
+            self.log(list2cmdline(['touch', path]))
             if not self.dry_run:
-                os.chmod(path, 0666) # Race condition?
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_NOCTTY, mode))
+                os.utime(path, None)
+                os.chmod(path, mode)
     
-    def copy(self, source, dest):
-        if dest not in self.copied_files:
-            self.copied_files.add(dest)
-            self.call(['cp', '-np', source, dest])
+    def copy(self, source, dest, mode=0666):
+        """Copy a file, unless the destination already exists, preserving its
+        times and (where permitted) ownership, then set its mode. Logged as
+        ``cp -np source dest``."""
+        if self._claim(self.copied_files, dest):
+            self.log(list2cmdline(['cp', '-np', source, dest]))
             if not self.dry_run:
-                os.chmod(dest, 0666) # Race condition?
+                self._copy(source, dest, mode)
+
+    def _copy(self, source, dest, mode):
+
+        # O_EXCL gives us cp's no-clobber without a race. We always set the
+        # mode though, even on a file which was already there.
+        try:
+            fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOCTTY, mode)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                os.chmod(dest, mode)
+                return
+            raise
+
+        try:
+            with os.fdopen(fd, 'wb') as dst_fh, open(source, 'rb') as src_fh:
+                shutil.copyfileobj(src_fh, dst_fh)
+            stat = os.stat(source)
+            os.utime(dest, (stat.st_atime, stat.st_mtime))
+        except:
+            os.unlink(dest)
+            raise
+
+        # Like cp -p, quietly keep our own ownership if we can't give it away.
+        try:
+            os.chown(dest, stat.st_uid, stat.st_gid)
+        except OSError as e:
+            if e.errno != errno.EPERM:
+                raise
+
+        os.chmod(dest, mode)
 
@@ -0,0 +1,173 @@
+"""Finding the projects within a root directory.
+
+A root may have hundreds of projects in it, and listing it and reading the
+tags of every one of them on a network filesystem is slow enough to notice
+every time a tool starts. So we keep what we found in an index within the
+root (see :class:`ProjectIndex`).
+
+Paths are then matched to the projects that contain them with a
+:class:`PrefixMap`.
+
+"""
+
+import errno
+import json
+import logging
+import os
+import time
+
+from .tags import dump_tags, load_tags
+
+
+log = logging.getLogger(__name__)
+
+
+class ProjectIndex(object):
+
+    """The Project tags of every directory in the top level of a root, stored in
+    ``{root}/.sgfs/projects.json``.
+
+    The index is trusted for as long as the mtime of the root is unchanged,
+    i.e. until something is added to, removed from, or renamed within it, or
+    until it is :meth:`invalidated <invalidate>`. It is then updated by checking the fingerprint of every directory's tags, and
+    only reading those which have changed.
+
+    :param sgfs: The owning :class:`~sgfs.sgfs.SGFS`.
+    :param str root: The root directory.
+
+    """
+
+    version = 1
+
+    # Filesystems may only have 1 second mtime resolution, so we don't trust
+    # the mtime of a root which was just modified, since it may be modified
+    # again without changing.
+    mtime_slack = 2.0
+
+    def __init__(self, sgfs, root):
+        self.sgfs = sgfs
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(self.root, '.sgfs', 'projects.json')
+
+    def _load(self):
+        try:
+            with open(self.path) as fh:
+                data = json.load(fh)
+        except (IOError, ValueError) as e:
+            if getattr(e, 'errno', None) != errno.ENOENT:
+                log.debug('could not read project index at %s: %s' % (self.path, e))
+            return None
+        if not isinstance(data, dict) or data.get('version') != self.version:
+            return None
+        return data
+
+    def _save(self, data):
+
+        dir_path = os.path.dirname(self.path)
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+
+        # Everyone needs to be able to update it.
+        umask = os.umask(0)
+        try:
+            if not os.path.exists(dir_path):
+                os.makedirs(dir_path)
+            with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666), 'w') as fh:
+                json.dump(data, fh, sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError, ValueError) as e:
+            log.debug('could not write project index at %s: %s' % (self.path, e))
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+        finally:
+            os.umask(umask)
+
+    def invalidate(self):
+        """Force the next :meth:`entries` to check every directory's tags.
+
+        Tagging a directory which is already in the root doesn't change the
+        mtime of the root, so whoever writes those tags must call this.
+
+        """
+        data = self._load()
+        if data is not None and data.get('mtime') is not None:
+            data['mtime'] = None
+            self._save(data)
+
+    def entries(self):
+        """Get the Project tags in the root.
+
+        :returns: ``list`` of ``(path, is_link, tags)`` for every directory in
+            the root, where ``tags`` are the raw Project tags that
+            :meth:`~sgfs.sgfs.SGFS.get_directory_entity_tags` would return.
+
+        """
+
+        root_mtime = os.stat(self.root).st_mtime
+        data = self._load()
+
+        if data is not None and data.get('mtime') == root_mtime:
+            self.sgfs.stats['project_index.hit'] += 1
+            entries = data['entries']
+
+        else:
+            self.sgfs.stats['project_index.update'] += 1
+            old_entries = data['entries'] if data is not None else {}
+            entries = {}
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                fingerprint = repr(self.sgfs._tag_fingerprint(path))
+                entry = old_entries.get(name)
+                if entry is None or entry['fingerprint'] != fingerprint:
+                    self.sgfs.stats['project_index.read'] += 1
+                    tags = self.sgfs.get_directory_entity_tags(path, merge_into_session=False)
+                    tags = [tag for tag in tags if tag['entity']['type'] == 'Project']
+                    entry = {'fingerprint': fingerprint, 'tags': dump_tags(tags, 'jsonl')}
+                entry['is_link'] = os.path.islink(path)
+                entries[name] = entry
+            if time.time() - root_mtime < self.mtime_slack:
+                root_mtime = None
+            self._save({'version': self.version, 'mtime': root_mtime, 'entries': entries})
+
+        # JSON gives us back unicode, but we want paths as they are listed.
+        return [(
+            os.path.join(self.root, name.encode('utf8') if isinstance(name, unicode) else name),
+            entry['is_link'],
+            load_tags(entry['tags'], 'jsonl'),
+        ) for name, entry in sorted(entries.iteritems())]
+
+
+class PrefixMap(object):
+
+    """A mapping from directories to values, which finds the deepest directory
+    containing a given path.
+
+    Lookups go up the given path one component at a time, so they take time in
+    proportion to its depth rather than to how many directories there are, and
+    ``/proj/Foo`` never matches ``/proj/FooBar``.
+
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def __setitem__(self, path, value):
+        self._values[os.path.normpath(os.path.abspath(path))] = value
+
+    def find(self, path):
+        """Get ``(directory, value)`` for the deepest directory containing the
+        given path, or ``(None, None)``."""
+        path = os.path.normpath(os.path.abspath(path))
+        while True:
+            try:
+                return path, self._values[path]
+            except KeyError:
+                pass
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None, None
+            path = parent
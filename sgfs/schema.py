@@ -1,12 +1,65 @@
+import itertools
 import os
 import pkg_resources
+import threading
 
 import yaml
 
-from .structure import Structure
+from .structure import Structure, TemplateCache
 from .utils import cached_property
 
 
+_locators = None
+_roots = {}
+_locate_lock = threading.Lock()
+
+_loaded = {}
+_load_lock = threading.Lock()
+
+
+def locate_schema(name):
+    """Get the root directory of the named schema.
+
+    Absolute paths are returned as is; other names are passed to every
+    ``sgfs_schema_locators`` entry point (sorted by name) until one returns a
+    root. The entry points are only loaded once, and roots are remembered for
+    the life of the process.
+
+    """
+
+    if os.path.isabs(name):
+        return name
+
+    global _locators
+    with _locate_lock:
+
+        root = _roots.get(name)
+        if root:
+            return root
+
+        if _locators is None:
+            eps = list(pkg_resources.iter_entry_points('sgfs_schema_locators'))
+            eps.sort(key=lambda ep: ep.name)
+            _locators = [ep.load() for ep in eps]
+
+        for func in _locators:
+            root = func(name)
+            if root:
+                break
+        else:
+            raise ValueError("No sgfs_schema_locators returned a root.", name)
+
+        _roots[name] = root
+        return root
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
 class Schema(object):
     
     """A template of file structures to create for Shotgun entities.
@@ -22,28 +75,18 @@ class Schema(object):
 
     """
 
-    def __init__(self, name=None, entity_type='Project', config_name=None):
+    def __init__(self, name=None, entity_type='Project', config_name=None, templates=None):
         
         #: The name of the schema, taken from :envvar:`SGFS_SCHEMA`.
         self.name = name = name or os.environ.get('SGFS_SCHEMA')
         if not name:
             raise ValueError("Schema name/path must be given or set by $SGFS_SCHEMA")
 
-        if os.path.isabs(self.name):
-            root = self.name
+        self.root = root = locate_schema(name)
 
-        else:
-            eps = list(pkg_resources.iter_entry_points('sgfs_schema_locators'))
-            eps.sort(key=lambda ep: ep.name)
-            for ep in eps:
-                func = ep.load()
-                root = func(self.name)
-                if root:
-                    break
-            else:
-                raise ValueError("No sgfs_schema_locators returned a root.", self.name)
-        
-        self.root = root
+        #: The :class:`~sgfs.structure.TemplateCache` shared by this schema
+        #: and all of its children.
+        self.templates = templates or TemplateCache()
         self.entity_type = entity_type
         self.config_name = config_name or entity_type + '.yml'
         self.config = yaml.load(open(os.path.join(root, self.config_name)).read())
@@ -53,13 +96,57 @@ class Schema(object):
         default_template = os.path.join(root, os.path.splitext(self.config_name)[0])
         if os.path.exists(default_template):
             self.config.setdefault('template', default_template)
-    
+
+    @classmethod
+    def load(cls, name=None):
+        """Get the fully loaded schema with the given name, shared by everyone
+        in this process.
+
+        The schema is reloaded if any of the config files it was built from,
+        or the default template directories, are modified, created or
+        removed, or if any template directory that has been scanned while
+        building structures is changed. Otherwise, this costs one ``stat`` per
+        file; treat the result (and its configs) as read-only.
+
+        :param str name: The name of the schema; defaults to :envvar:`SGFS_SCHEMA`.
+        :returns: :class:`Schema`
+
+        """
+
+        name = name or os.environ.get('SGFS_SCHEMA')
+        if not name:
+            raise ValueError("Schema name/path must be given or set by $SGFS_SCHEMA")
+        root = locate_schema(name)
+
+        with _load_lock:
+            loaded = _loaded.get(root)
+            if loaded is not None:
+                schema, mtimes = loaded
+                mtimes = itertools.chain(mtimes, schema.templates.dependencies())
+                if all(_mtime(path) == mtime for path, mtime in mtimes):
+                    return schema
+
+            schema = cls(root)
+            mtimes = [(path, _mtime(path)) for path in schema._iter_dependencies()]
+            _loaded[root] = (schema, mtimes)
+            return schema
+
+    def _iter_dependencies(self):
+        # Everything we look at while loading, forcing all of the children to
+        # load along the way.
+        base = os.path.join(self.root, os.path.splitext(self.config_name)[0])
+        yield os.path.join(self.root, self.config_name)
+        yield base
+        for child in self.children.itervalues():
+            for path in child._iter_dependencies():
+                yield path
+
     @cached_property
     def children(self):
         # Load all the children.
         children = {}
         for child_type, child_config_name in self.config.get('children', {}).iteritems():
-            children[child_type] = Schema(self.root, child_type, child_config_name)
+            children[child_type] = Schema(self.root, child_type, child_config_name, self.templates)
         return children
     
     def __repr__(self):
@@ -112,7 +199,7 @@ class Schema(object):
             root = sgfs.root
         
         # Create the structure node for this entity.
-        structure = Structure.from_context(context, self.config.copy(), root)
+        structure = Structure.from_context(context, self.config.copy(), root, self.templates)
         if not structure:
             return
         
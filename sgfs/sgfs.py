@@ -1,17 +1,24 @@
+import collections
+import contextlib
+import copy
 import datetime
 import logging
 import os
-
-import yaml
+import sys
+import threading
+import time
 
 from dirmap import DirMap
 from sgsession import Session
 from sgsession.utils import shotgun_api3_connect
 
 from . import utils
-from .cache import PathCache
+from .cache import PathCache, parse_verify_policy
 from .context import Context
+from .projects import PrefixMap, ProjectIndex
 from .schema import Schema
+from .tags import load_tags, dump_tags, formats as tag_formats, file_names as tag_file_names
+from .walk import SchemaPruner, walk_directory_tags
 
 
 log = logging.getLogger('sgfs')
@@ -26,11 +33,32 @@ class SGFS(object):
         a clean wrapper around the given ``shotgun``.
     :param shotgun: The ``Shotgun`` API to use. Defaults to an automatically
         constructed instance via ``shotgun_api3_registry``.
+    :param int tag_cache_size: How many directories' parsed tags to hold onto.
+        Defaults to ``$SGFS_TAG_CACHE_SIZE``, or 1024.
+    :param str tag_format: The format to write tags in; ``"yml"`` or
+        ``"jsonl"`` (see :mod:`sgfs.tags`). Both are always read. Defaults to
+        ``$SGFS_TAG_FORMAT``, or ``"yml"``.
+    :param verify_tags: When to verify that the paths we get from the path
+        cache are still tagged; ``"always"``, ``"never"``, or a number of
+        seconds to trust a previous verification for (see
+        :func:`~sgfs.cache.parse_verify_policy`). Defaults to
+        ``$SGFS_VERIFY_TAGS``, or ``"always"``.
+    :param int verify_cache_size: How many directories' verifications to hold
+        onto for ``verify_tags``. Defaults to ``$SGFS_VERIFY_CACHE_SIZE``, or
+        4096.
+    :param int untagged_cache_size: How many directories to remember as being
+        untagged (see :meth:`get_directory_entity_tags`). Defaults to
+        ``$SGFS_UNTAGGED_CACHE_SIZE``, or 4096.
+    :param int lookup_cache_size: How many results of
+        :meth:`entities_from_path` and :meth:`context_from_path` to memoize;
+        ``0`` disables it. Defaults to ``$SGFS_LOOKUP_CACHE_SIZE``, or 1024.
     
     """
     
     def __init__(self, root=None, session=None, shotgun=None, schema_name=None,
-        cache_name=None, dir_map=None):
+        cache_name=None, dir_map=None, tag_cache_size=None, tag_format=None,
+        verify_tags=None, verify_cache_size=None, untagged_cache_size=None,
+        lookup_cache_size=None):
 
         # This constructor is very light weight, not really doing anything
         # until you ask for it.
@@ -49,6 +77,50 @@ class SGFS(object):
         self.cache_name = cache_name or os.environ.get('SGFS_CACHE_NAME', PathCache.default_name)
 
         self._dir_map = dir_map
+
+        self.tag_format = tag_format or os.environ.get('SGFS_TAG_FORMAT', 'yml')
+        if self.tag_format not in tag_formats:
+            raise ValueError('tag_format must be one of %s; got %r' % (', '.join(tag_formats), self.tag_format))
+
+        # PathCache instances, keyed by (project_root, name).
+        self._path_caches = {}
+        self._path_caches_lock = threading.Lock()
+        self._path_cache_batches = threading.local()
+
+        # Parsed tags, keyed by the path to the tag file, and validated against
+        # a fingerprint of the file.
+        if tag_cache_size is None:
+            tag_cache_size = int(os.environ.get('SGFS_TAG_CACHE_SIZE', 1024))
+        self._tag_cache = utils.LRUCache(tag_cache_size)
+
+        # The mtimes of directories which we found no tags in, keyed by path.
+        # There are usually many more of these than tagged ones.
+        if untagged_cache_size is None:
+            untagged_cache_size = int(os.environ.get('SGFS_UNTAGGED_CACHE_SIZE', 4096))
+        self._untagged_dirs = utils.LRUCache(untagged_cache_size)
+
+        # Results of entities_from_path and context_from_path, with the
+        # directories they depend upon (see _record_lookup_dependency).
+        if lookup_cache_size is None:
+            lookup_cache_size = int(os.environ.get('SGFS_LOOKUP_CACHE_SIZE', 1024))
+        self._lookup_cache = utils.LRUCache(lookup_cache_size)
+        self._lookup_dependencies = threading.local()
+
+        #: How many seconds to trust a verification of a cached path for;
+        #: ``0`` is always verifying, and ``None`` is never.
+        if verify_tags is None:
+            verify_tags = os.environ.get('SGFS_VERIFY_TAGS', 'always')
+        self.verify_max_age = parse_verify_policy(verify_tags)
+
+        # When each entity was last verified to be tagged in a directory, keyed
+        # by the directory, then by (type, id). This is sized separately from
+        # the tag cache, since shrinking that shouldn't undo the policy.
+        if verify_cache_size is None:
+            verify_cache_size = int(os.environ.get('SGFS_VERIFY_CACHE_SIZE', 4096))
+        self._verified_tags = utils.LRUCache(verify_cache_size)
+
+        #: Counters of cache hits/misses, etc., for benchmarking and debugging.
+        self.stats = collections.Counter()
     
     @utils.cached_property
     def session(self):
@@ -65,28 +137,86 @@ class SGFS(object):
         if not (self.root or raw_env_paths):
             raise ValueError("SGFS must be given root, or have $SGFS_ROOT or $SGFS_PROJECTS set.")
 
-        paths = []
+        # Entries are (path, is_link, tags), with tags of None to be read.
+        entries = []
 
-        # Scan the root looking for Project tags in its top level.
+        # Look for Project tags in the top level of the root; the index does
+        # this without listing it (or reading them) every time.
         if self.root:
-            paths.extend(os.path.join(self.root, name) for name in os.listdir(self.root))
+            entries.extend(ProjectIndex(self, self.root).entries())
 
         # Also consider the paths we've been directly given.
         raw_env_paths = os.environ.get('SGFS_PROJECTS')
         if raw_env_paths:
-            paths.extend(raw_env_paths.split(':'))
+            entries.extend((path, os.path.islink(path), None) for path in raw_env_paths.split(':'))
 
         # We look at links first so that they get overwritten by data in "real"
         # directories later. This is so that the "real" directory has priority
         # over a link to itself.
-        paths.sort(key=lambda path: (not os.path.islink(path), path))
+        entries.sort(key=lambda entry: (not entry[1], entry[0]))
 
         roots = {}
-        for path in paths:
-            for tag in self.get_directory_entity_tags(path):
+        aliases = []
+        for path, _, tags in entries:
+            if tags is None:
+                tags = self.get_directory_entity_tags(path)
+            for tag in tags:
                 if tag['entity']['type'] == 'Project':
-                    roots[tag['entity']] = path
+                    entity = self.session.merge(tag['entity'], created_at=tag['created_at'])
+                    roots[entity] = path
+                    aliases.append((path, entity))
+
+        # Every path we found a project at is an alias to its root.
+        self._project_root_aliases = aliases
+
         return roots
+
+    @utils.cached_property
+    def _project_root_map(self):
+        roots = self.project_roots
+        prefix_map = PrefixMap()
+        # Aliases first, so that the roots themselves take precedence.
+        pairs = self._project_root_aliases + [(path, project) for project, path in roots.iteritems()]
+        for path, project in pairs:
+            prefix_map[os.path.realpath(path)] = project
+            prefix_map[path] = project
+        return prefix_map
+
+    def _add_project_root(self, project, path):
+        self.project_roots[project] = path
+        prefix_map = self._project_root_map
+        prefix_map[os.path.realpath(path)] = project
+        prefix_map[path] = project
+
+    def find_project_root(self, path):
+        """Get the project which contains the given path, and the path relative
+        to its root.
+
+        Paths are matched one directory at a time, so this is fast even with
+        many projects. Symlinks to project roots (and any other paths that the
+        project was found at, e.g. via :envvar:`SGFS_PROJECTS`) are accepted,
+        as are paths which only match once symlinks are resolved.
+
+        :param str path: The path to look up.
+        :returns: ``(project, path)``, with ``path`` re-rooted within the
+            project's root, or ``(None, path)`` if it is not within a project.
+
+        """
+
+        path = os.path.abspath(path)
+
+        prefix_map = self._project_root_map
+        prefix, project = prefix_map.find(path)
+        if project is not None:
+            return project, self.project_roots[project] + path[len(prefix):]
+
+        real_path = os.path.realpath(path)
+        if real_path != path:
+            prefix, project = prefix_map.find(real_path)
+            if project is not None:
+                return project, self.project_roots[project] + real_path[len(prefix):]
+
+        return None, path
     
     @utils.cached_property
     def dir_map(self):
@@ -104,17 +234,81 @@ class SGFS(object):
         name = name or self.cache_name
 
         if isinstance(project, basestring):
-            path = os.path.abspath(project)
-            for project_root in self.project_roots.itervalues():
-                if path.startswith(project_root): # TODO: Do better.
-                    return PathCache(self, project_root, name)
-        
+            project, _ = self.find_project_root(project)
+            if project is None:
+                return
         else:
             project = project.project()
-            project_root = self.project_roots.get(project)
-            if project_root is not None:
-                return PathCache(self, project_root, name)
 
+        project_root = self.project_roots.get(project)
+        if project_root is not None:
+            return self._get_path_cache(project_root, name)
+
+    def _get_path_cache(self, project_root, name):
+
+        # Constructing a PathCache lists and stats quite a few things, so we
+        # hold onto them. They notice caches being added or removed themselves
+        # (see PathCache._refresh_read_paths).
+        key = (project_root, name)
+
+        with self._path_caches_lock:
+
+            path_cache = self._path_caches.get(key)
+            if path_cache is not None:
+                self.stats['path_cache.hit'] += 1
+
+            else:
+                path_cache = PathCache(self, project_root, name)
+                self.stats['path_cache.constructed'] += 1
+                self._path_caches[key] = path_cache
+
+        # Join any batch that this thread is in.
+        batches = getattr(self._path_cache_batches, 'batches', None)
+        if batches is not None and id(path_cache) not in batches:
+            batch = path_cache.batch()
+            batch.__enter__()
+            batches[id(path_cache)] = (path_cache, batch)
+
+        return path_cache
+
+    def clear_path_caches(self):
+        """Forget all :class:`~sgfs.cache.PathCache` objects we have built."""
+        with self._path_caches_lock:
+            self._path_caches.clear()
+
+    @contextlib.contextmanager
+    def batch_path_caches(self):
+        """Batch the writes to every :class:`~sgfs.cache.PathCache` that this
+        thread uses within the block.
+
+        See :meth:`.PathCache.batch`; :meth:`create_structure` and
+        :meth:`tag_existing_structure` do this automatically.
+
+        """
+
+        local = self._path_cache_batches
+        if getattr(local, 'batches', None) is not None:
+            yield
+            return
+
+        local.batches = batches = {}
+        try:
+            yield
+        finally:
+            local.batches = None
+
+            # Every cache gets to commit, even if another one fails to. We
+            # raise the first error once they are all done.
+            error = None
+            for path_cache, batch in batches.itervalues():
+                try:
+                    batch.__exit__(None, None, None)
+                except Exception:
+                    log.exception('could not commit batch to %r' % path_cache)
+                    if error is None:
+                        error = sys.exc_info()
+            if error is not None:
+                raise error[0], error[1], error[2]
 
     def path_for_entity(self, entity):
         """Get the path on disk for the given entity.
@@ -143,64 +337,206 @@ class SGFS(object):
         """
         
         entity = self.session.merge(entity)
-        
-        # Projects are special cased; we should always know the paths to all
-        # projects.
-        if entity['type'] == 'Project':
-            return self.project_roots.get(entity)
-        
-        # If we already know the project for this entity, then look it up in the
-        # project_roots.
-        project = entity.project(fetch=False)
-        if project is not None:
+        return self.paths_for_entities([entity])[entity]
+
+    def paths_for_entities(self, entities):
+        """Get the paths on disk for many entities at once.
+
+        :param list entities: The :class:`~sgsession.entity.Entity` to look up.
+        :return: ``dict`` mapping every given entity to a ``str``, or ``None``
+            if it does not have a tagged directory.
+
+        This is the bulk version of :meth:`path_for_entity`; each path cache
+        is queried once for all entities in its project, and each directory's
+        tags are only read once.
+
+        """
+
+        entities = self.session.merge(list(entities))
+        paths = dict.fromkeys(entities)
+
+        by_project = {}
+        unknown = []
+        for entity in entities:
+
+            # Projects are special cased; we should always know the paths to all
+            # projects.
+            if entity['type'] == 'Project':
+                paths[entity] = self.project_roots.get(entity)
+                continue
+
+            # If we already know the project for this entity, then look it up in
+            # the project_roots.
+            project = entity.project(fetch=False)
+            if project is not None:
+                by_project.setdefault(project, []).append(entity)
+            else:
+                unknown.append(entity)
+
+        for project, group in by_project.iteritems():
             path_cache = self.path_cache(project)
-            return path_cache.get(entity) if path_cache is not None else None
-        
-        
+            if path_cache is not None:
+                paths.update(path_cache.get_many(group))
+
         # It should be cheaper to hit the disk to poll all caches than to query
         # the Shotgun server for the project.
         for project in self.project_roots:
+            if not unknown:
+                break
             path_cache = self.path_cache(project)
-            path = path_cache.get(entity) if path_cache is not None else None
-            if path is not None:
-                return path
+            if path_cache is None:
+                continue
+            found = path_cache.get_many(unknown)
+            paths.update(found)
+            unknown = [x for x in unknown if x not in found]
 
-    def _write_directory_tags(self, path, tags, replace=False, backup=True):
+        return paths
 
-        serialized = yaml.dump_all(tags,
-            explicit_start=True,
-            indent=4,
-            default_flow_style=False
-        )
+    def _write_directory_tags(self, path, tags, replace=False, backup=True):
 
         path = os.path.abspath(path)
-        tag_path = os.path.join(path, '.sgfs.yml')
+        tag_path = os.path.join(path, tag_file_names[self.tag_format])
+        serialized = dump_tags(tags, self.tag_format)
+
+        self._tag_cache.pop(path)
+        self._verified_tags.pop(path)
+        self._untagged_dirs.pop(path)
 
         umask = os.umask(0111) # Race condition when threaded?
         try:
-            if replace and backup and os.path.exists(tag_path):
-                backup_path = os.path.join(path, '.sgfs.%s.yml' % datetime.datetime.utcnow().strftime('%y%m%d.%H%M%S.%f'))
-                with open(tag_path, 'r') as rfh, open(backup_path, 'w') as wfh:
-                    wfh.write(rfh.read())
+
+            # When replacing, we write all of the tags in our format, so tags
+            # in any other format are superseded.
+            existing = []
+            if replace:
+                existing = [os.path.join(path, tag_file_names[x]) for x in tag_formats]
+                existing = [x for x in existing if os.path.exists(x)]
+
+            if backup:
+                timestamp = datetime.datetime.utcnow().strftime('%y%m%d.%H%M%S.%f')
+                for existing_path in existing:
+                    ext = os.path.splitext(existing_path)[1]
+                    backup_path = os.path.join(path, '.sgfs.%s%s' % (timestamp, ext))
+                    with open(existing_path, 'r') as rfh, open(backup_path, 'w') as wfh:
+                        wfh.write(rfh.read())
+
             with open(tag_path, 'w' if replace else 'a') as fh:
                 fh.write(serialized)
+
+            for existing_path in existing:
+                if existing_path != tag_path:
+                    os.unlink(existing_path)
+
         finally:
             os.umask(umask)
 
+        # The project index won't otherwise notice that the tags of a
+        # directory in the root have changed.
+        if self.root and os.path.dirname(path) == self.root:
+            ProjectIndex(self, self.root).invalidate()
+
+    def _tag_fingerprint(self, path):
+        """Stat every tag format in the given directory; this is both an
+        existence check and a fingerprint to validate caches with."""
+        return tuple(self._stat_tag_file(path, format) for format in tag_formats)
+
+    def _stat_tag_file(self, path, format):
+        try:
+            stat = os.stat(os.path.join(path, tag_file_names[format]))
+        except OSError:
+            return None
+        return (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+
     def _read_directory_tags(self, path):
 
         path = os.path.abspath(path)
 
-        tag_path = os.path.join(path, '.sgfs.yml')
-        if not os.path.exists(tag_path):
+        # Creating a tag file changes the mtime of the directory, so a single
+        # stat tells us if a directory is still untagged. Upward walks pass
+        # through the same untagged directories over and over again.
+        untagged_mtime = self._untagged_dirs.get(path)
+        recording = getattr(self._lookup_dependencies, 'value', None) is not None
+        mtime = None
+        if untagged_mtime is not None or recording:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                pass
+            if untagged_mtime is not None and mtime == untagged_mtime:
+                self.stats['untagged_cache.hit'] += 1
+                self._record_lookup_dependency(path, mtime, None)
+                return []
+
+        fingerprint = self._tag_fingerprint(path)
+        self._record_lookup_dependency(path, mtime, fingerprint)
+        if not any(fingerprint):
+            self._remember_untagged(path)
             return []
-        
-        with open(tag_path) as fh:
-            tags = list(yaml.load_all(fh.read()))
+
+        # Callers are free to modify what we return, so we always give them
+        # a copy of what we have cached.
+        cached = self._tag_cache.get(path)
+        if cached is not None and cached[0] == fingerprint:
+            self.stats['tag_cache.hit'] += 1
+            return copy.deepcopy(cached[1])
+        self.stats['tag_cache.miss'] += 1
+
+        tags = []
+        for format, stat in zip(tag_formats, fingerprint):
+            if stat is not None:
+                with open(os.path.join(path, tag_file_names[format])) as fh:
+                    tags.extend(load_tags(fh.read(), format))
 
         tags = self.dir_map.deep_apply(tags)
 
-        return tags
+        self._tag_cache[path] = (fingerprint, tags)
+        return copy.deepcopy(tags)
+
+    def _record_lookup_dependency(self, path, mtime, fingerprint):
+        """Note that the current :meth:`_memoized_lookup` (if any) read the
+        tags of the given directory.
+
+        The mtime of the directory (taken before reading) changes if a tag
+        file is created or removed, so that and the tag files which were
+        actually read are all that need checking later. A directory modified
+        too recently to trust its mtime is checked by its full fingerprint.
+
+        """
+        dependencies = getattr(self._lookup_dependencies, 'value', None)
+        if dependencies is None:
+            return
+        if mtime is not None and time.time() - mtime > 2:
+            files = tuple((format, stat) for format, stat in zip(tag_formats, fingerprint or ()) if stat is not None)
+            dependencies.append((path, mtime, files))
+        else:
+            dependencies.append((path, None, tuple(zip(tag_formats, fingerprint))))
+
+    def _check_lookup_dependency(self, dependency):
+        path, mtime, files = dependency
+        if mtime is not None:
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return all(self._stat_tag_file(path, format) == stat for format, stat in files)
+
+    def _remember_untagged(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        # Filesystems may only have 1 second mtime resolution, so a directory
+        # modified just now may be modified again without changing it.
+        if time.time() - mtime > 2:
+            self._untagged_dirs[path] = mtime
+
+    def clear_tag_cache(self):
+        """Forget all parsed tags (and verified paths); they will be read from
+        disk again."""
+        self._tag_cache.clear()
+        self._verified_tags.clear()
+        self._untagged_dirs.clear()
 
     def tag_directory_with_entity(self, path, entity, meta=None, cache=True):
         """Tag a directory with the given entity, and add it to the cache.
@@ -216,6 +552,10 @@ class SGFS(object):
 
         path = os.path.abspath(path)
 
+        # The cache can only speak for all of the tags of this directory if
+        # they are all cached, and we aren't going to read them to find out.
+        had_tags = cache and any(self._tag_fingerprint(path))
+
         tag = dict(meta or {})
         tag.update({
             'created_at': datetime.datetime.utcnow(),
@@ -226,14 +566,15 @@ class SGFS(object):
             
         # Add it to the local project roots.
         if entity['type'] == 'Project':
-            self.project_roots[entity] = path
+            self._add_project_root(entity, path)
         
         # Add to path cache.
         if cache:
             path_cache = self.path_cache(entity.project())
             if path_cache is None:
                 raise ValueError('could not get path cache for %r from %r' % (entity.project(), entity))
-            path_cache[entity] = path
+            fingerprint = repr(self._tag_fingerprint(path))
+            path_cache.set(entity, path, tag=tag, fingerprint=fingerprint, complete=not had_tags)
     
     def get_directory_entity_tags(self, path, allow_duplicates=False, allow_moves=False, merge_into_session=True):
         """Get the tags for the given directory.
@@ -288,14 +629,106 @@ class SGFS(object):
         
         return tags
 
-    def entities_from_path(self, path, entity_type=None):
+    def _current_cached_tag(self, path, tag, fingerprint, fingerprints):
+        """Get a tag from the path cache if the tags of its directory have not
+        changed since it was cached, or ``None``.
+
+        The tag files are the source of truth, so callers must read them
+        instead when we return ``None``.
+
+        :param dict fingerprints: Current fingerprints by path, so that each
+            directory is only checked once.
+
+        """
+        if tag is not None and fingerprint is not None:
+            try:
+                current = fingerprints[path]
+            except KeyError:
+                current = fingerprints[path] = repr(self._tag_fingerprint(path))
+            if current == fingerprint:
+                self.stats['path_cache.tag_hit'] += 1
+                return tag
+        self.stats['path_cache.tag_miss'] += 1
+        return None
+
+    def _iter_ancestors(self, path):
+        path = os.path.abspath(path)
+        while path and path != '/':
+            yield path
+            path = os.path.dirname(path)
+
+    def _cached_ancestors(self, path, entity_type=None):
+        """Get the directories at or above the given path which the path cache
+        says are tagged (with one of the given types), deepest first.
+
+        Their tags must still be read to confirm them.
+
+        """
+
+        ancestors = list(self._iter_ancestors(path))
+        if not ancestors:
+            return []
+
+        try:
+            cache = self.path_cache(ancestors[0])
+        except ValueError:
+            # We have no roots to find projects in.
+            return []
+        if cache is None:
+            return []
+
+        cached = cache.entities_at_paths(ancestors)
+        return [
+            path for path in ancestors
+            if path in cached and (entity_type is None or any(e['type'] in entity_type for e in cached[path]))
+        ]
+
+    def _bounded_ancestors(self, path, entity_type=None):
+        """Get the directories at or above the given path to read tags from,
+        using the path cache as an upper bound, deepest first.
+
+        Every directory up to the deepest one the cache knows about is
+        included, since there may be tags below it which were never cached;
+        the untagged cache makes that cheap. Above that, only the cached
+        directories are included.
+
+        :returns: ``list`` of ``(directory, is_cached)``. If a cached directory
+            turns out not to be tagged, then the cache is out of date and the
+            caller must walk every directory instead.
+
+        """
+
+        cached = self._cached_ancestors(path, entity_type)
+        if not cached:
+            return []
+
+        directories = []
+        for directory in self._iter_ancestors(path):
+            directories.append((directory, directory == cached[0]))
+            if directory == cached[0]:
+                break
+        directories.extend((directory, True) for directory in cached[1:])
+        return directories
+
+    def entities_from_path(self, path, entity_type=None, use_cache=True):
         """Get the most specific entities that have been tagged in a parent
         directory of the given path, optionally limited to a given type.
         
+        The path cache is used as an upper bound on where to look: every
+        directory up to the deepest cached one is still read (so directories
+        which were tagged without caching them are found), but above it only
+        the cached directories are. We only walk up reading every directory if
+        none of those pan out.
+
         :param str path: The path to find entities for.
         :param str entity_type: The type (or set of types) to look for. None will return
             the first entities found.
+        :param bool use_cache: Use the path cache to bound the walk?
         :return: ``tuple`` of :class:`~sgsession.entity.Entity`.
+
+        Results are memoized until the tags of any directory which was read to
+        find the entities change; see
+        :meth:`clear_lookup_cache`, and the ``lookup_cache.*`` :attr:`stats`.
         
         E.g.::
             
@@ -320,23 +753,86 @@ class SGFS(object):
         # Convert type into a set of strings, or None.
         if entity_type is not None:
             if isinstance(entity_type, basestring):
-                entity_type = set([entity_type])
+                entity_type = frozenset([entity_type])
             else:
-                entity_type = set(entity_type)
-        
+                entity_type = frozenset(entity_type)
+
         path = os.path.abspath(path)
-        while path and path != '/':
-            tags = self.get_directory_entity_tags(path)
-            
-            # Perform the type filter.
-            if entity_type is not None:
-                tags = [tag for tag in tags if tag['entity']['type'] in entity_type]
-            
-            if tags:
-                return self.session.merge([x['entity'] for x in tags])
-            
-            path = os.path.dirname(path)
+        key = ('entities', path, entity_type, use_cache)
+        entities = self._memoized_lookup(key, lambda: self._entities_from_path(path, entity_type, use_cache))
+
+        # Callers are free to modify what we return.
+        return list(entities) if isinstance(entities, list) else entities
+
+    def _entities_from_path(self, path, entity_type, use_cache):
+
+        passes = [[(x, False) for x in self._iter_ancestors(path)]]
+        if use_cache:
+            passes.insert(0, self._bounded_ancestors(path, entity_type))
+
+        for directories in passes:
+            for directory, is_cached in directories:
+
+                tags = self.get_directory_entity_tags(directory)
+
+                # Perform the type filter.
+                if entity_type is not None:
+                    tags = [tag for tag in tags if tag['entity']['type'] in entity_type]
+
+                if tags:
+                    return self.session.merge([x['entity'] for x in tags])
+
+                # The cache is out of date, so we can't trust it to skip
+                # anything; walk every directory instead.
+                if is_cached:
+                    break
+
         return ()
+
+    def _memoized_lookup(self, key, func):
+        """Memoize a lookup which reads the tags of directories.
+
+        Every directory whose tags the lookup reads is recorded (see
+        :meth:`_record_lookup_dependency`), and the result is reused until
+        tags are created, changed, or removed in any of them. That usually
+        costs one stat per directory.
+
+        """
+
+        # Recording what we read costs a stat per directory, so don't bother.
+        if self._lookup_cache.maxsize <= 0:
+            return func()
+
+        memo = self._lookup_cache.get(key)
+        if memo is not None:
+            result, dependencies = memo
+            if all(self._check_lookup_dependency(x) for x in dependencies):
+                self.stats['lookup_cache.hit'] += 1
+                return result
+        self.stats['lookup_cache.miss'] += 1
+
+        outer = getattr(self._lookup_dependencies, 'value', None)
+        dependencies = self._lookup_dependencies.value = []
+        try:
+            result = func()
+        finally:
+            self._lookup_dependencies.value = outer
+        if outer is not None:
+            outer.extend(dependencies)
+
+        self._lookup_cache[key] = (result, dependencies)
+        return result
+
+    def clear_lookup_cache(self):
+        """Forget all memoized results of :meth:`entities_from_path` and
+        :meth:`context_from_path`.
+
+        They are validated against the tags on disk every time they are used,
+        so this is only needed to release memory or to see the effect of
+        changes made to the path cache alone.
+
+        """
+        self._lookup_cache.clear()
     
     def entity_from_path(self, path, entity_type=None):
         entities = self.entities_from_path(path, entity_type)
@@ -344,7 +840,7 @@ class SGFS(object):
             raise ValueError("Loaded {} of {} from {}".format(len(entities), entity_type or 'any type', path))
         return entities[0]
 
-    def entities_in_directory(self, path, entity_type=None, load_tags=False, primary_root=None):
+    def entities_in_directory(self, path, entity_type=None, load_tags=False, primary_root=None, max_depth=None):
         """Iterate across every :class:`~sgsession.entity.Entity` within the
         given directory.
         
@@ -355,6 +851,9 @@ class SGFS(object):
         :param bool load_tags: Load data cached in tags? None implies automatic.
         :param str primary_root: Any directory within the primary project root.
             None implies the given path.
+        :param int max_depth: How many levels of directories below the given
+            path to look; ``1`` will find the entities directly within it.
+            None implies unlimited.
         :return: Iterator of ``(path, entity)`` tuples.
         
         E.g.::
@@ -367,36 +866,76 @@ class SGFS(object):
             ('<snip>/SEQ/GC/GC_001_001/Light', <Entity Task:43898 at 0x1011bee80>)
             
         """
-        path = os.path.abspath(path)
+        # Paths via aliases of the project root are cached relative to the
+        # root itself.
+        _, path = self.find_project_root(path)
         cache = self.path_cache(primary_root or path)
         if cache is None:
             raise ValueError('No SGFS cache above directory.', path)
-        for path, entity in cache.walk_directory(path, entity_type):
-            if load_tags or (load_tags is None and len(entity) == 2):
-                self.get_directory_entity_tags(path)
+
+        if load_tags is not None and not load_tags:
+            for path, entity in cache.walk_directory(path, entity_type, max_depth=max_depth):
+                yield path, entity
+            return
+
+        fingerprints = {}
+        for path, entity, tag, fingerprint, _ in cache.walk_tags(path, entity_type, max_depth=max_depth):
+            if load_tags or len(entity) == 2:
+                tag = self._current_cached_tag(path, tag, fingerprint, fingerprints)
+                if tag is not None:
+                    self.session.merge(tag['entity'], created_at=tag['created_at'])
+                else:
+                    self.get_directory_entity_tags(path)
             yield path, entity
     
     def entity_tags_in_directory(self, path, **kwargs):
         """Iterate across every tag within the given directory.
         
-        This uses the path cache to avoid actually walking the directory.
+        This uses the path cache to avoid actually walking the directory, and
+        the tags stored in it to avoid reading those which have not changed.
         
         :param str path: The path to walk for entities.
         :param kwargs: Passed to :func:`~sgfs.sgfs.SGFS.get_directory_entity_tags`.
         :return: Iterator of ``(path, tag_dict)`` tuples.
             
         """
-        path = os.path.abspath(path)
+        _, path = self.find_project_root(path)
         cache = self.path_cache(path)
-        visited = set()
-        for path, entity in cache.walk_directory(path):
-            if path in visited:
-                continue
-            visited.add(path)
-            for tag in self.get_directory_entity_tags(path, **kwargs):
+
+        # Only the newest unmoved tags are cached.
+        use_cached = not (kwargs.get('allow_duplicates') or kwargs.get('allow_moves'))
+        merge_into_session = kwargs.get('merge_into_session', True)
+
+        rows_by_path = collections.OrderedDict()
+        for path, entity, tag, fingerprint, complete in cache.walk_tags(path):
+            rows_by_path.setdefault(path, []).append((tag, fingerprint, complete))
+
+        fingerprints = {}
+        for path, rows in rows_by_path.iteritems():
+
+            tags = None
+            if use_cached:
+                cached = [self._current_cached_tag(path, tag, fingerprint, fingerprints) for tag, fingerprint, _ in rows]
+                if all(tag is not None for tag in cached) and all(complete for _, _, complete in rows):
+                    # The same entity may be cached here by several caches.
+                    newest_tags = {}
+                    for tag in cached:
+                        key = (tag['entity']['type'], tag['entity']['id'])
+                        older_tag = newest_tags.get(key)
+                        if older_tag is None or tag['created_at'] > older_tag['created_at']:
+                            newest_tags[key] = tag
+                    tags = newest_tags.values()
+                    if merge_into_session:
+                        for tag in tags:
+                            tag['entity'] = self.session.merge(tag['entity'], created_at=tag['created_at'])
+
+            if tags is None:
+                tags = self.get_directory_entity_tags(path, **kwargs)
+
+            for tag in tags:
                 yield path, tag
     
-    def rebuild_cache(self, path, recurse=False, dry_run=False, verbose=False, cache_path=None):
+    def rebuild_cache(self, path, recurse=False, dry_run=False, verbose=False, cache_path=None, jobs=1, prune=False):
         """Rebuilds the cache for a given directory.
         
         This is useful when a tagged directory has been moved, breaking the
@@ -406,13 +945,19 @@ class SGFS(object):
         :param str path: The path to rebuild the cache for.
         :param bool recurse: Should we recursively walk the path, or just look
             at the given one?
+        :param int jobs: How many threads to walk the path with when recursing;
+            see :func:`sgfs.walk.walk_directory_tags`.
+        :param bool prune: Skip directories which our schema says cannot
+            contain tags when recursing; see :class:`sgfs.walk.SchemaPruner`.
         :raises ValueError: when ``path`` is not within a project.
         :returns: ``list`` of changed ``(old_path, found_path, tag)``
         """
         
-        root_path = os.path.abspath(path)
+        # Tags and the cache should refer to the root itself, rather than any
+        # aliases of it.
+        _, root_path = self.find_project_root(path)
 
-        cache_path = cache_path or path
+        cache_path = cache_path or root_path
         cache = self.path_cache(cache_path)
         if cache is None:
             raise ValueError("Could not get path cache from {}".format(cache_path))
@@ -420,16 +965,23 @@ class SGFS(object):
         # Find all the tags.
         to_check = []
         if recurse:
-            for path, dir_names, file_names in os.walk(root_path):
-                for tag in self.get_directory_entity_tags(path, allow_moves=True):
+            pruner = SchemaPruner.load(self.schema_name) if prune else None
+            pruned = self.stats['walk.pruned']
+            # The walk is concurrent (and so unordered), but everything below
+            # happens in this thread, in a stable order with parents first.
+            for path, tags in sorted(walk_directory_tags(self, root_path, jobs=jobs, prune=pruner, allow_moves=True)):
+                for tag in tags:
+                    tag['entity'] = self.session.merge(tag['entity'], created_at=tag['created_at'])
                     to_check.append((path, tag))
+            if verbose and pruner:
+                print 'Pruned {} directories'.format(self.stats['walk.pruned'] - pruned)
         else:
             for tag in self.get_directory_entity_tags(root_path, allow_moves=True):
                 to_check.append((root_path, tag))
         
         # Update them.
         changed = []
-        old_tags_by_path = {}
+        to_cache = collections.OrderedDict()
         for path, tag in to_check:
 
             entity = tag['entity']
@@ -440,22 +992,14 @@ class SGFS(object):
             old_path = cache.get(entity, check_tags=False)
 
             if old_path == path:
-                # Nothing to do!
+                # Nothing to do, except refresh the cached tag.
+                to_cache.setdefault(path, []).append(entity)
                 continue
 
-            try:
-                old_tags = old_tags_by_path[old_path] if old_path else []
-            except KeyError:
-                old_tags = old_tags_by_path[old_path] = self.get_directory_entity_tags(old_path, merge_into_session=False)
-
-            was_copied = False
-            for old_tag in old_tags:
-                old_entity = old_tag['entity']
-                if old_entity['type'] == entity['type'] and old_entity['id'] == entity['id']:
-                    was_copied = True
-                    break
-
-            if was_copied:
+            # If the tags at the old path haven't changed since we cached them
+            # then this is a copy (same tags, different inode), which we know
+            # without reading them.
+            if old_path and cache.is_tagged_at(entity, old_path):
                 log.warning('%s %s was copied from %s to %s; not updating cache' % (
                     entity['type'], entity['id'], old_path, path,
                 ))
@@ -484,13 +1028,32 @@ class SGFS(object):
                     # I want to know about this...
                     log.error('Tagged paths for %s did not match, but tags not out of date.' % path)
 
-            # Update the path cache.
-            if not dry_run:
-                cache[entity] = path
-
+            to_cache.setdefault(path, []).append(entity)
             changed.append((old_path, path, tag))
+
+        # Update the path cache.
+        if not dry_run:
+            with cache.batch():
+                for path, entities in to_cache.iteritems():
+                    self._cache_directory_tags(cache, path, entities)
         
         return changed
+
+    def _cache_directory_tags(self, cache, path, entities):
+        """Cache the given entities at a directory, along with their tags."""
+
+        fingerprint = repr(self._tag_fingerprint(path))
+        tags = self.get_directory_entity_tags(path, merge_into_session=False)
+        tags_by_key = dict(((tag['entity']['type'], tag['entity']['id']), tag) for tag in tags)
+
+        # The cache can only speak for all of the tags of this directory if
+        # they are all cached here.
+        keys = set((entity['type'], entity['id']) for entity in entities)
+        complete = set(tags_by_key) <= keys
+
+        for entity in entities:
+            tag = tags_by_key.get((entity['type'], entity['id']))
+            cache.set(entity, path, tag=tag, fingerprint=fingerprint, complete=complete)
     
     def context_from_entities(self, entities):
         """Construct a :class:`~sgfs.context.Context` graph which includes all
@@ -524,12 +1087,11 @@ class SGFS(object):
         
         # If we don't already have the parent of the entity then populate as
         # much as we can from the cache.
-        for entity in entities:
-            if entity.parent(fetch=False) and entity.project(fetch=False):
-                continue
-            path = self.path_for_entity(entity)
-            if path:
-                self.get_directory_entity_tags(path)
+        to_find = [x for x in entities if not (x.parent(fetch=False) and x.project(fetch=False))]
+        if to_find:
+            for path in set(self.paths_for_entities(to_find).itervalues()):
+                if path:
+                    self.get_directory_entity_tags(path)
         
         self.session.fetch_heirarchy(entities)
                 
@@ -577,11 +1139,13 @@ class SGFS(object):
         # The project is the root.
         return entity_to_context[projects[0]]
     
-    def context_from_path(self, path):
+    def context_from_path(self, path, use_cache=True):
         """Get a :class:`~sgfs.context.Context` with every tagged
         :class:`~sgsession.entity.Entity` in the given path.
         
         :param str path: The path to return a context for.
+        :param bool use_cache: Use the path cache to bound the walk?
+            See :meth:`entities_from_path`.
         
         This walks upwards on the path specified until it finds a directory
         that has been tagged as a ``Project``, and then returns a context
@@ -611,22 +1175,40 @@ class SGFS(object):
         may be ambiguous (e.g. non-linear), and may look like:
         
         .. graphviz:: /_graphs/sgfs/context_from_path.1.dot
+
+        Results are memoized (see :meth:`entities_from_path`); every call
+        returns a new copy of the graph, but the entities within are shared.
         
         """
-        entities = []
         path = os.path.abspath(path)
-        while path and path != '/':
-            for tag in self.get_directory_entity_tags(path):
-                entities.append(tag['entity'])
-                if tag['entity']['type'] == 'Project':
-                    return self.context_from_entities(entities)
-            path = os.path.dirname(path)
-        return
+        key = ('context', path, use_cache)
+        context = self._memoized_lookup(key, lambda: self._context_from_path(path, use_cache))
+
+        # Callers are free to modify what we return.
+        return context.copy_graph() if context is not None else None
+
+    def _context_from_path(self, path, use_cache):
+
+        passes = [[(x, False) for x in self._iter_ancestors(path)]]
+        if use_cache:
+            passes.insert(0, self._bounded_ancestors(path))
+
+        for directories in passes:
+            entities = []
+            for directory, is_cached in directories:
+                tags = self.get_directory_entity_tags(directory)
+                if is_cached and not tags:
+                    # The cache is out of date; see _entities_from_path.
+                    break
+                for tag in tags:
+                    entities.append(tag['entity'])
+                    if tag['entity']['type'] == 'Project':
+                        return self.context_from_entities(entities)
             
     def structure_from_entities(self, entities):
         """Create a :class:`.Structure` graph from the given entities"""
         context = self.context_from_entities(entities)
-        return Schema(self.schema_name).build_structure(self, context)
+        return Schema.load(self.schema_name).build_structure(self, context)
     
     def create_structure(self, entities, **kwargs):
         """Create the structure on disk for the given entities.
@@ -637,6 +1219,7 @@ class SGFS(object):
         :param bool dry_run: Don't actually create structure. Defaults to ``False``.
         :param bool verbose: Print out what is going on. Defaults to ``False``.
         :param bool allow_project: Allow creation of projects? Defaults to ``False``.
+        :param int jobs: How many threads to create things with. Defaults to ``1``.
         :return: A ``list`` of steps taken.
         
         """
@@ -1,6 +1,8 @@
 import fnmatch
 import os
+import threading
 
+from concurrent import futures
 import yaml
 
 from .processor import Processor
@@ -17,10 +19,110 @@ def _template_pattern_sort_key(x):
     )
 
 
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def scan_template(template):
+    """Describe the children of a template directory.
+
+    :param str template: The template directory.
+    :returns: ``(configs, dependencies)``, where ``configs`` is a ``list`` of
+        the structure configs of its children, and ``dependencies`` is a
+        ``list`` of ``(path, mtime)`` for every file the description was built
+        from.
+
+    """
+
+    dependencies = [(template, _mtime(template))]
+
+    # Build up the ignore list.
+    ignore = ['._*', '.sgfs-ignore']
+    ignore_file = os.path.join(template, '.sgfs-ignore')
+    if os.path.exists(ignore_file):
+        dependencies.append((ignore_file, _mtime(ignore_file)))
+        for line in open(ignore_file):
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            ignore.append(line)
+
+    # List the directory and apply the ignore list.
+    names = os.listdir(template)
+    names = [x for x in names if not any(fnmatch.fnmatch(x, pattern) for pattern in ignore)]
+    paths = [os.path.join(template, name) for name in sorted(names)]
+
+    configs = []
+
+    # Find anything special, and turn it into children.
+    for special in [x for x in paths if x.endswith('.yml')]:
+
+        dependencies.append((special, _mtime(special)))
+        config = yaml.load(open(special).read()) or {}
+        config.setdefault('name', os.path.basename(os.path.splitext(special)[0]))
+        config.setdefault('type', 'directory')
+
+        local_template = os.path.splitext(special)[0]
+        if os.path.exists(local_template):
+            config['template'] = local_template
+            paths.remove(local_template)
+
+        configs.append(config)
+
+    # Generic files/directories.
+    for path in [x for x in paths if not x.endswith('.yml')]:
+        configs.append({
+            'name': os.path.basename(path),
+            'type': 'directory' if os.path.isdir(path) else 'file',
+            'template': path,
+        })
+
+    return configs, dependencies
+
+
+class TemplateCache(object):
+
+    """Template directories which have already been scanned, so that building
+    many structures from one :class:`~sgfs.schema.Schema` only reads each of
+    its templates once.
+
+    Nothing here is checked against the disk; see
+    :meth:`~sgfs.schema.Schema.load` for how that happens.
+
+    """
+
+    def __init__(self):
+        self._scanned = {}
+        self._lock = threading.Lock()
+
+    def scan(self, template):
+        """Get the child configs of the given template; see :func:`scan_template`.
+
+        The configs are shared, so must not be modified.
+
+        """
+        try:
+            return self._scanned[template][0]
+        except KeyError:
+            pass
+        scanned = scan_template(template)
+        with self._lock:
+            self._scanned.setdefault(template, scanned)
+        return scanned[0]
+
+    def dependencies(self):
+        """Get ``(path, mtime)`` for every file read by a scan so far."""
+        with self._lock:
+            return [dep for _, deps in self._scanned.itervalues() for dep in deps]
+
+
 class Structure(object):
     
     @classmethod
-    def from_context(cls, context, config, root):
+    def from_context(cls, context, config, root, templates=None):
         
         type_ = config.get('type')
         constructor = {
@@ -39,13 +141,14 @@ class Structure(object):
             context.build_eval_namespace(config),
             filename='sgfs.schema.%s.%s' % (context.entity['type'], 'condition')
         ):
-            return constructor(context, config, root)
+            return constructor(context, config, root, templates)
 
     
-    def __init__(self, context, config, root):
+    def __init__(self, context, config, root, templates=None):
         
         self.context = context
         self.config = config
+        self.templates = templates
         
         # Delegate to subclasses.
         self._set_name_and_path(root)
@@ -97,22 +200,60 @@ class Structure(object):
         if depth_first:
             yield self
     
-    def create(self, **kwargs):
+    def create(self, jobs=1, **kwargs):
+        """Create this structure on disk.
+
+        :param int jobs: How many threads to create things with. Nodes are only
+            started once their parent is done, and tags are always written
+            from the calling thread.
+        :param kwargs: Passed to :class:`.Processor`.
+        :return: A ``list`` of steps taken.
+
+        """
         processor = Processor(**kwargs)
-        for node in self.walk():
-            node._create(processor)
+        with self.sgfs.batch_path_caches():
+            if jobs > 1:
+                self._create_concurrently(processor, jobs)
+            else:
+                for node in self.walk():
+                    node._create(processor)
+                    node._after_create(processor)
         return processor.log_events
+
+    def _create_concurrently(self, processor, jobs):
+        with futures.ThreadPoolExecutor(jobs) as executor:
+            pending = {executor.submit(self._create, processor): self}
+            try:
+                while pending:
+                    done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        node = pending.pop(future)
+                        future.result()
+                        node._after_create(processor)
+                        for child in node.children:
+                            pending[executor.submit(child._create, processor)] = child
+            except:
+                for future in pending:
+                    future.cancel()
+                raise
         
     def _create(self, processor):
+        """Create this node on disk; this may be called from any thread."""
+        pass
+
+    def _after_create(self, processor):
+        """Finish creating this node (from the thread that started the
+        creation), before any of its children are created."""
         pass
     
     def tag_existing(self, **kwargs):
         res = []
         processor = Processor(**kwargs)
-        for node in self.walk():
-            x = node._tag_existing(processor)
-            if x:
-                res.append(x)
+        with self.sgfs.batch_path_caches():
+            for node in self.walk():
+                x = node._tag_existing(processor)
+                if x:
+                    res.append(x)
         return res
     
     def _tag_existing(self, processor):
@@ -129,8 +270,8 @@ class Structure(object):
 
 class Directory(Structure):
     
-    def __init__(self, context, config, root):
-        super(Directory, self).__init__(context, config, root)
+    def __init__(self, context, config, root, templates=None):
+        super(Directory, self).__init__(context, config, root, templates)
         template = config.get('template')
         if template:
             self._scan_template(template)
@@ -139,47 +280,16 @@ class Directory(Structure):
         processor.mkdir(self.path)
         
     def _scan_template(self, template):
-        
-        # Build up the ignore list.
-        ignore = ['._*', '.sgfs-ignore']
-        ignore_file = os.path.join(template, '.sgfs-ignore')
-        if os.path.exists(ignore_file):
-            for line in open(ignore_file):
-                line = line.strip()
-                if not line or line[0] == '#':
-                    continue
-                ignore.append(ignore_file)
-            
-        # List the directory and apply the ignore list.
-        names = os.listdir(template)
-        names = [x for x in names if not any(fnmatch.fnmatch(x, pattern) for pattern in ignore)]
-        paths = [os.path.join(template, name) for name in names]
-            
-        # Find anything special, and turn it into children.
-        for special in [x for x in paths if x.endswith('.yml')]:
-                
-            config = yaml.load(open(special).read()) or {}
-            config.setdefault('name', os.path.basename(os.path.splitext(special)[0]))
-            config.setdefault('type', 'directory')
-            
-            local_template = os.path.splitext(special)[0]
-            if os.path.exists(local_template):
-                config['template'] = local_template
-                paths.remove(local_template)
-                
-            child = Structure.from_context(self.context, config, self.path)
+
+        if self.templates is not None:
+            configs = self.templates.scan(template)
+        else:
+            configs, _ = scan_template(template)
+
+        for config in configs:
+            child = Structure.from_context(self.context, dict(config), self.path, self.templates)
             if child is not None:
                 self.children.append(child)
-        
-        # Generic files/directories.
-        for path in [x for x in paths if not x.endswith('.yml')]:
-            self.children.append(Structure.from_context(
-                self.context, {
-                    'name': os.path.basename(path),
-                    'type': 'directory' if os.path.isdir(path) else 'file',
-                    'template': path,
-                }, self.path,
-            ))
     
     def _repr_headline(self):
         return (self.name or '.') + '/'
@@ -227,6 +337,9 @@ class Entity(Directory):
             processor.assert_allow_entity(self.entity)
             
             processor.mkdir(self.path)
+
+    def _after_create(self, processor):
+        if not self.existing_path and not processor.dry_run:
             self.sgfs.tag_directory_with_entity(self.path, self.entity)
         
 
@@ -0,0 +1,246 @@
+"""Serialization of the tags that we place in directories.
+
+Tags only ever contain plain data (mappings, lists, strings, numbers and
+datetimes), and may be stored in one of two formats:
+
+``yml``
+    YAML documents in ``.sgfs.yml``; the original (and default) format. We load
+    them with the safe loader, which is much faster when backed by libyaml.
+    Older tag files may also contain a few of the Python-specific YAML tags
+    that the default dumper emits, and so we construct those (as plain data)
+    as well.
+
+``jsonl``
+    One JSON object per line in ``.sgfs.jsonl``, which is much faster to parse.
+    Datetimes are stored in ISO form as ``{"$datetime": "..."}``, and dates as
+    ``{"$date": "..."}``.
+
+Directories may have tags in both formats, which are read in the order above.
+
+"""
+
+import datetime
+import json
+import logging
+
+import yaml
+
+
+log = logging.getLogger(__name__)
+
+
+try:
+    _BaseLoader = yaml.CSafeLoader
+    _BaseDumper = yaml.CSafeDumper
+except AttributeError:
+    _BaseLoader = yaml.SafeLoader
+    _BaseDumper = yaml.SafeDumper
+
+#: Is libyaml being used to load and dump tags?
+has_libyaml = _BaseLoader is not yaml.SafeLoader
+
+
+class TagLoader(_BaseLoader):
+    """A safe YAML loader, which also accepts the Python-specific tags found in
+    older tag files."""
+
+
+def _construct_python_unicode(loader, node):
+    return loader.construct_scalar(node)
+
+def _construct_python_str(loader, node):
+    value = loader.construct_scalar(node)
+    try:
+        return value.encode('ascii')
+    except UnicodeEncodeError:
+        return value.encode('utf8')
+
+def _construct_python_long(loader, node):
+    return long(loader.construct_yaml_int(node))
+
+def _construct_python_tuple(loader, node):
+    return tuple(loader.construct_sequence(node))
+
+def _construct_python_name(loader, suffix, node):
+    return suffix
+
+def _construct_python_object(loader, suffix, node):
+
+    # We don't want to import arbitrary classes, so we return as much of the
+    # data as we can. Everything in a tag is a dict, so for dict subclasses
+    # (e.g. Entities) this is actually pretty good.
+    log.debug('loading python/object%s as plain data' % suffix)
+
+    if isinstance(node, yaml.ScalarNode):
+        return loader.construct_scalar(node)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+
+    value = loader.construct_mapping(node, deep=True)
+    if not suffix.startswith(':'):
+        # This is from a "new" or "apply", which may have data in several places.
+        data = {}
+        state = value.get('state')
+        if isinstance(state, tuple):
+            state = state[0]
+        if isinstance(state, dict):
+            data.update(state)
+        data.update(value.get('dictitems') or {})
+        if data or 'listitems' not in value:
+            return data
+        return value['listitems']
+    return value
+
+
+for _name in ('bool', 'float', 'int', 'none'):
+    TagLoader.add_constructor('tag:yaml.org,2002:python/' + _name, TagLoader.yaml_constructors['tag:yaml.org,2002:' + ('null' if _name == 'none' else _name)])
+TagLoader.add_constructor('tag:yaml.org,2002:python/list', TagLoader.yaml_constructors['tag:yaml.org,2002:seq'])
+TagLoader.add_constructor('tag:yaml.org,2002:python/dict', TagLoader.yaml_constructors['tag:yaml.org,2002:map'])
+TagLoader.add_constructor('tag:yaml.org,2002:python/unicode', _construct_python_unicode)
+TagLoader.add_constructor('tag:yaml.org,2002:python/str', _construct_python_str)
+TagLoader.add_constructor('tag:yaml.org,2002:python/long', _construct_python_long)
+TagLoader.add_constructor('tag:yaml.org,2002:python/tuple', _construct_python_tuple)
+TagLoader.add_multi_constructor('tag:yaml.org,2002:python/name:', _construct_python_name)
+TagLoader.add_multi_constructor('tag:yaml.org,2002:python/module:', _construct_python_name)
+TagLoader.add_multi_constructor('tag:yaml.org,2002:python/object', _construct_python_object)
+
+
+class TagDumper(_BaseDumper):
+    """A safe YAML dumper, which writes dict subclasses (e.g. Entities) as plain
+    mappings, and tuples as lists."""
+
+
+TagDumper.add_multi_representer(dict, TagDumper.represent_dict)
+TagDumper.add_representer(tuple, TagDumper.represent_list)
+
+
+def load_yaml_tags(serialized):
+    """Deserialize the tags from the contents of a ``.sgfs.yml`` file.
+
+    :param str serialized: The YAML documents.
+    :return: ``list`` of ``dict``.
+
+    """
+    return list(yaml.load_all(serialized, Loader=TagLoader))
+
+
+def dump_yaml_tags(tags):
+    """Serialize tags as they are stored in a ``.sgfs.yml`` file.
+
+    :param list tags: The ``dict`` tags to serialize.
+    :return: ``str`` of YAML documents.
+
+    """
+    return yaml.dump_all(tags,
+        Dumper=TagDumper,
+        explicit_start=True,
+        indent=4,
+        default_flow_style=False,
+    )
+
+
+# We parse timestamps exactly as YAML does so that both formats agree.
+_timestamp_constructor = yaml.constructor.SafeConstructor()
+
+def _parse_timestamp(value):
+    return _timestamp_constructor.construct_yaml_timestamp(yaml.ScalarNode('tag:yaml.org,2002:timestamp', value))
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return dict((k, _to_json(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_to_json(x) for x in value]
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'$date': value.isoformat()}
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, dict):
+        if len(value) == 1:
+            raw = value.get('$datetime') or value.get('$date')
+            if raw is not None:
+                return _parse_timestamp(raw)
+        return dict((_from_json(k), _from_json(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return [_from_json(x) for x in value]
+    if isinstance(value, unicode):
+        # Match YAML, which gives us str unless it must be unicode.
+        try:
+            return value.encode('ascii')
+        except UnicodeEncodeError:
+            return value
+    return value
+
+
+def load_json_tags(serialized):
+    """Deserialize the tags from the contents of a ``.sgfs.jsonl`` file.
+
+    :param str serialized: The JSON objects, one per line.
+    :return: ``list`` of ``dict``.
+
+    """
+    return [_from_json(json.loads(line)) for line in serialized.splitlines() if line.strip()]
+
+
+def dump_json_tags(tags):
+    """Serialize tags as they are stored in a ``.sgfs.jsonl`` file.
+
+    :param list tags: The ``dict`` tags to serialize.
+    :return: ``str`` of JSON objects, one per line.
+
+    """
+    return ''.join(json.dumps(_to_json(tag), sort_keys=True, separators=(',', ':')) + '\n' for tag in tags)
+
+
+#: The supported formats, in the order that they are read.
+formats = ('yml', 'jsonl')
+
+#: The name of the tag file for each format.
+file_names = {
+    'yml': '.sgfs.yml',
+    'jsonl': '.sgfs.jsonl',
+}
+
+_loaders = {
+    'yml': load_yaml_tags,
+    'jsonl': load_json_tags,
+}
+
+_dumpers = {
+    'yml': dump_yaml_tags,
+    'jsonl': dump_json_tags,
+}
+
+
+def load_tags(serialized, format):
+    """Deserialize tags in the given format.
+
+    :param str serialized: The contents of a tag file.
+    :param str format: One of :data:`formats`.
+    :return: ``list`` of ``dict``.
+
+    """
+    try:
+        loader = _loaders[format]
+    except KeyError:
+        raise ValueError('unknown tag format %r' % format)
+    return loader(serialized)
+
+
+def dump_tags(tags, format):
+    """Serialize tags in the given format.
+
+    :param list tags: The ``dict`` tags to serialize.
+    :param str format: One of :data:`formats`.
+    :return: ``str`` to append to (or replace) a tag file.
+
+    """
+    try:
+        dumper = _dumpers[format]
+    except KeyError:
+        raise ValueError('unknown tag format %r' % format)
+    return dumper(tags)
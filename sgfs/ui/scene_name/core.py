@@ -22,6 +22,7 @@ import os
 import re
 
 from sgfs import SGFS
+from sgfs.tags import file_names as tag_file_names
 
 
 class SceneName(object):
@@ -210,8 +211,7 @@ class SceneName(object):
         step_dir = os.path.dirname(os.path.dirname(self.workspace))
         try:
             for name in os.listdir(step_dir):
-                # XXX: Hardcoded SGFS tag name?!
-                if os.path.exists(os.path.join(step_dir, name, '.sgfs.yml')):
+                if any(os.path.exists(os.path.join(step_dir, name, x)) for x in tag_file_names.itervalues()):
                     self._step_names.append(name)
         except OSError:
             pass
@@ -1,6 +1,14 @@
 import collections
+import contextlib
 import functools
 import itertools
+import threading
+import time
+import types
+
+
+# Filled in with ``[count, seconds]`` per expression while profiling.
+_expr_profile = None
 
 
 def eval_expr_or_func(src, globals_, locals_=None, filename=None):
@@ -8,19 +16,65 @@ def eval_expr_or_func(src, globals_, locals_=None, filename=None):
     if filename is None:
         filename = '<string:%s>' % (src.encode('string-escape'))
 
+    key = (src, filename)
+    compiled = _compiled_exprs.get(key)
+    if compiled is None:
+        compiled = _compile_expr_or_func(src, filename)
+        _compiled_exprs[key] = compiled
+    is_func, code = compiled
+
+    profile = _expr_profile
+    if profile is not None:
+        start = time.time()
+
+    if is_func:
+        res = types.FunctionType(code, globals_, '__expr__')()
+    else:
+        res = eval(code, globals_)
+
+    if profile is not None:
+        record = profile.setdefault(key, [0, 0.0])
+        record[0] += 1
+        record[1] += time.time() - start
+
+    return res
+
+
+def _compile_expr_or_func(src, filename):
     lines = src.strip().splitlines()
     if len(lines) > 1:
-        # Surely I can create a function object directly with a compiled code
-        # object, but I couldn't quit figure it out in the time that I allowed.
-        # Ergo, we are evalling strings. Sorry.
+        # Compile the source as the body of a function, and pull that
+        # function's code out so it can be bound to new globals every time.
         src = 'def __expr__():\n' + '\n'.join('\t' + line for line in lines)
-        locals_ = locals_ if locals_ is not None else {}
         code = compile(src, filename, 'exec')
-        eval(code, globals_, locals_)
-        return locals_['__expr__']()
+        for const in code.co_consts:
+            if isinstance(const, types.CodeType):
+                return True, const
+        raise ValueError('could not compile function', src)
     else:
-        code = compile(lines[0], filename, 'eval')
-        return eval(code, globals_)
+        return False, compile(lines[0], filename, 'eval')
+
+
+@contextlib.contextmanager
+def profile_exprs():
+    """Record how long every schema expression takes within this block.
+
+    Yields a ``dict`` mapping ``(source, filename)`` to ``[count, seconds]``,
+    which is filled in as expressions are evaluated, e.g.::
+
+        >>> with profile_exprs() as profile:
+        ...     sgfs.create_structure(entities, dry_run=True)
+        >>> for (src, filename), (count, seconds) in sorted(profile.iteritems(), key=lambda x: -x[1][1]):
+        ...     print '%8.3fs %6d %s' % (seconds, count, filename)
+
+    """
+    global _expr_profile
+    previous = _expr_profile
+    _expr_profile = profile = {}
+    try:
+        yield profile
+    finally:
+        _expr_profile = previous
 
 
 class cached_property(object):
@@ -65,3 +119,50 @@ class chain_map(collections.Mapping):
                 visited.add(k)
                 yield k
 
+
+
+class LRUCache(object):
+
+    """A thread-safe mapping which only holds onto its most recently used items.
+
+    :param int maxsize: How many items to keep; ``0`` disables the cache.
+
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Compiled code for eval_expr_or_func, keyed by (source, filename).
+_compiled_exprs = LRUCache(1024)
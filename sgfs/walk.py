@@ -0,0 +1,245 @@
+"""Walking directory trees for tags.
+
+Listing directories and reading tags on a network filesystem is almost
+entirely latency, so we do it with a pool of threads. Only the listing and
+parsing happen in the pool; results are handed back to the calling thread, so
+whatever consumes them (e.g. a path cache writer) does not need to be
+thread-safe.
+
+Walks may also be pruned with what the schema knows about where tags can be
+(see :class:`SchemaPruner`).
+
+"""
+
+import logging
+import os
+
+from concurrent import futures
+
+from .schema import Schema
+from .tags import file_names as tag_file_names
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+log = logging.getLogger(__name__)
+
+
+def _list_directory(path):
+    """Get ``(sub_directories, has_tags)`` for the given directory.
+
+    Like :func:`os.walk`, this does not follow symlinks, and ignores errors.
+
+    """
+
+    tag_names = set(tag_file_names.itervalues())
+
+    try:
+
+        if scandir is not None:
+            # The directory entries usually know their own type, which saves
+            # us a stat per entry.
+            dirs = []
+            has_tags = False
+            for entry in scandir(path):
+                if entry.name in tag_names:
+                    has_tags = True
+                elif entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+            return dirs, has_tags
+
+        names = os.listdir(path)
+
+    except OSError:
+        return [], False
+
+    dirs = []
+    for name in names:
+        child = os.path.join(path, name)
+        if os.path.isdir(child) and not os.path.islink(child):
+            dirs.append(child)
+    return dirs, any(name in tag_names for name in names)
+
+
+class SchemaPruner(object):
+
+    """Decides which directories cannot contain tags, according to a
+    :class:`~sgfs.schema.Schema`.
+
+    We prune the directories that a schema creates verbatim from its templates
+    within entities that have no children in the schema (e.g.
+    ``Task/nuke/renders``), except for those that a path template points into
+    (e.g. ``Task/maya/published``). Entities with children may have them at
+    any depth, so we never prune within them.
+
+    """
+
+    def __init__(self, schema):
+        self._templates = schema.templates
+        self._prunable = {}
+        self._add_schema(schema)
+
+    def _add_schema(self, schema):
+
+        prunable = set()
+        if not schema.children:
+            static = set()
+            reserved = set()
+            self._scan_config(schema.config, (), static, reserved)
+            for rel in static:
+                if not any(self._is_reserved(rel, res, is_open) for res, is_open in reserved):
+                    prunable.add(rel)
+
+        # The same type may appear in several places in the schema, so only
+        # prune what is prunable in all of them.
+        existing = self._prunable.get(schema.entity_type)
+        self._prunable[schema.entity_type] = prunable if existing is None else (existing & prunable)
+
+        for child in schema.children.itervalues():
+            self._add_schema(child)
+
+    @staticmethod
+    def _is_reserved(rel, reserved, is_open):
+        # Anything on the way to a template, or within a template's variable
+        # part, may be tagged.
+        return reserved[:len(rel)] == rel or (is_open and rel[:len(reserved)] == reserved)
+
+    def _scan_config(self, config, rel, static, reserved):
+
+        for format_string in config.get('templates', {}).itervalues():
+            parts = []
+            is_open = False
+            for part in str(format_string).split('/'):
+                if '{' in part:
+                    is_open = True
+                    break
+                if part:
+                    parts.append(part)
+            reserved.add((rel + tuple(parts), is_open))
+
+        template = config.get('template')
+        if not template or not os.path.isdir(template):
+            return
+
+        for child in self._templates.scan(template):
+            type_ = child.get('type', 'directory')
+            if type_ == 'include':
+                self._scan_config(child, rel, static, reserved)
+            elif type_ == 'directory':
+                child_rel = rel + (str(child['name']), )
+                static.add(child_rel)
+                self._scan_config(child, child_rel, static, reserved)
+
+    @classmethod
+    def load(cls, schema_name=None):
+        """Get a pruner for the named schema (see :meth:`.Schema.load`).
+
+        Pruning is only an optimization, so if there is no schema configured
+        (or it can't be loaded) we warn and return ``None``, which walks
+        everything.
+
+        """
+        try:
+            schema = Schema.load(schema_name)
+        except (IOError, ValueError) as e:
+            log.warning('walking every directory since the schema could not be loaded: %s' % e)
+            return None
+        return cls(schema)
+
+    def enter(self, state, tags):
+        """Get the state for the children of a directory.
+
+        :param state: The state of the directory, or ``None`` if unknown.
+        :param list tags: The tags of the directory.
+
+        """
+        if tags:
+            return frozenset(tag.get('entity', {}).get('type') for tag in tags), ()
+        return state
+
+    def child(self, state, name):
+        """Get ``(state, prunable)`` for a child of a directory.
+
+        :param state: The state returned by :meth:`enter`.
+        :param str name: The name of the child.
+
+        """
+        if state is None:
+            return None, False
+        types, rel = state
+        rel = rel + (name, )
+        return (types, rel), all(rel in self._prunable.get(type_, ()) for type_ in types)
+
+
+def _visit(sgfs, path, state, probe, tag_kwargs):
+
+    # We don't even list pruned directories, but they may still be tagged
+    # (e.g. by a Task which happens to share a name with a template).
+    if probe and not any(os.path.exists(os.path.join(path, name)) for name in tag_file_names.itervalues()):
+        return path, state, None, []
+
+    dirs, has_tags = _list_directory(path)
+    tags = sgfs.get_directory_entity_tags(path, **tag_kwargs) if has_tags else []
+    return path, state, dirs, tags
+
+
+def walk_directory_tags(sgfs, root, jobs=1, prune=None, **tag_kwargs):
+    """Walk a directory tree, yielding the tags of every directory.
+
+    :param sgfs: The :class:`~sgfs.sgfs.SGFS` to read tags with.
+    :param str root: The directory to start at.
+    :param int jobs: How many threads to list directories and read tags with;
+        ``1`` does everything in the calling thread.
+    :param prune: A :class:`SchemaPruner` to skip directories with, or ``None``
+        to walk everything. The number of skipped directories is counted in
+        ``sgfs.stats['walk.pruned']``.
+    :param tag_kwargs: Passed to :meth:`~sgfs.sgfs.SGFS.get_directory_entity_tags`;
+        ``merge_into_session`` is always ``False`` since sessions are not
+        thread-safe.
+    :return: Iterator of ``(path, tags)`` for every directory which has tags,
+        in no particular order.
+
+    """
+
+    root = os.path.abspath(root)
+    tag_kwargs['merge_into_session'] = False
+
+    def expand(result):
+        path, state, dirs, tags = result
+        if dirs is None:
+            sgfs.stats['walk.pruned'] += 1
+            return []
+        if prune is None:
+            return [(child, None, False) for child in dirs]
+        state = prune.enter(state, tags)
+        children = []
+        for child in dirs:
+            child_state, prunable = prune.child(state, os.path.basename(child))
+            children.append((child, child_state, prunable))
+        return children
+
+    if jobs <= 1:
+        to_visit = [(root, None, False)]
+        while to_visit:
+            result = _visit(sgfs, *to_visit.pop(), tag_kwargs=tag_kwargs)
+            to_visit.extend(reversed(expand(result)))
+            if result[3]:
+                yield result[0], result[3]
+        return
+
+    with futures.ThreadPoolExecutor(jobs) as executor:
+        pending = set([executor.submit(_visit, sgfs, root, None, False, tag_kwargs)])
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                for args in expand(result):
+                    pending.add(executor.submit(_visit, sgfs, *args, tag_kwargs=tag_kwargs))
+                if result[3]:
+                    yield result[0], result[3]
@@ -109,4 +109,29 @@ class TestContextFromPath(TestCase):
         
         
 
-       
\ No newline at end of file
+       
+    def test_uncached_tags_are_found(self):
+
+        self.sgfs.create_structure(self.tasks, allow_project=True)
+        root = os.path.join(self.sandbox, self.proj_name.replace(' ', '_'))
+        task_path = root + '/SEQ/AA/AA_001/Anm'
+        deep_path = task_path + '/maya/scenes/v0001'
+        os.makedirs(deep_path)
+
+        sgfs = SGFS(root=self.sandbox, session=self.session)
+        for use_cache in (True, False):
+            entities = sgfs.entities_from_path(deep_path, use_cache=use_cache)
+            self.assertEqual(1, len(entities))
+            self.assertSameEntity(entities[0], self.tasks[0])
+            entities = sgfs.entities_from_path(deep_path, entity_type='Sequence', use_cache=use_cache)
+            self.assertSameEntity(entities[0], self.seqs[0])
+            context = sgfs.context_from_path(deep_path, use_cache=use_cache)
+            self.assertEqual(4, len(context.linear_base))
+
+        # Tagged, but not in the cache.
+        pub = self.session.merge(self.fix.PublishEvent('Uncached', project=self.proj))
+        sgfs.tag_directory_with_entity(deep_path, pub, cache=False)
+        entities = sgfs.entities_from_path(deep_path, use_cache=False)
+        self.assertSameEntity(entities[0], pub)
+        entities = sgfs.entities_from_path(deep_path, entity_type='PublishEvent')
+        self.assertSameEntity(entities[0], pub)
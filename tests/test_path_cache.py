@@ -1,5 +1,6 @@
 from subprocess import check_call
 import os
+import sqlite3
 
 from common import *
 
@@ -22,7 +23,7 @@ class TestCache(TestCase):
         self.assertEqual(1, len(cache))
         self.assertEqual(cache.get(proj), root)
         
-        stat = os.stat(os.path.join(root, '.sgfs/caches/500-primary.sqlite'))
+        stat = os.stat(os.path.join(root, '.sgfs/caches/500-primary.v2.sqlite'))
         print oct(stat.st_mode)
         self.assertEqual(stat.st_mode & 0777, 0666)
     
@@ -43,7 +44,7 @@ class TestCache(TestCase):
         self.assertEqual(len(logs), 1)
         self.assertEqual(logs[0].levelname, 'WARNING')
 
-        stat = os.stat(os.path.join(root, '.sgfs/caches/500-primary.sqlite'))
+        stat = os.stat(os.path.join(root, '.sgfs/caches/500-primary.v2.sqlite'))
         print oct(stat.st_mode)
         self.assertEqual(stat.st_mode & 0777, 0666)
     
@@ -112,8 +113,8 @@ class TestCache(TestCase):
 
         cache2[pub] = pub_dir
 
-        os.stat(os.path.join(root, '.sgfs/caches/500-primary.sqlite'))
-        os.stat(os.path.join(root, '.sgfs/caches/600-test.sqlite'))
+        os.stat(os.path.join(root, '.sgfs/caches/500-primary.v2.sqlite'))
+        os.stat(os.path.join(root, '.sgfs/caches/600-test.v2.sqlite'))
 
         # A new cache will see 2 entities.
         pairs = list(sgfs.entities_in_directory(root))
@@ -123,6 +124,505 @@ class TestCache(TestCase):
         self.assertEqual(pairs[1][0], pub_dir)
         self.assertIs(pairs[1][1], pub)
 
+    def test_paths_for_entities(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        pubs = []
+        for i in range(5):
+            pub = sgfs.session.merge(self.fix.PublishEvent('Publish %d' % i, project=proj))
+            pub_dir = os.path.join(root, 'Publish %d' % i)
+            os.makedirs(pub_dir)
+            sgfs.tag_directory_with_entity(pub_dir, pub)
+            pubs.append(pub)
+
+        # One which is not tagged anywhere.
+        missing = sgfs.session.merge(self.fix.PublishEvent('Missing', project=proj))
+
+        paths = sgfs.paths_for_entities([proj, missing] + pubs)
+        self.assertEqual(len(paths), 7)
+        self.assertEqual(paths[proj], root)
+        self.assertIs(paths[missing], None)
+        for i, pub in enumerate(pubs):
+            self.assertEqual(paths[pub], os.path.join(root, 'Publish %d' % i))
+            self.assertEqual(sgfs.path_for_entity(pub), paths[pub])
+
+    def test_new_read_caches_are_found(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+
+        for read_mode in ('attach', 'each'):
+
+            cache = sgfs.path_cache(proj)
+            cache.read_mode = read_mode
+            root = cache.get(proj)
+
+            pub_dir = os.path.join(root, 'Publish ' + read_mode)
+            os.makedirs(pub_dir)
+            pub = sgfs.session.merge(self.fix.PublishEvent('Publish ' + read_mode, project=proj))
+            sgfs.tag_directory_with_entity(pub_dir, pub, cache=False)
+
+            # Write via a cache which the first has never seen.
+            other = sgfs.path_cache(proj, name='600-' + read_mode)
+            other[pub] = pub_dir
+
+            self.assertEqual(cache.get(pub), pub_dir)
+
+    def test_journals_do_not_reattach(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+
+        cache = sgfs.path_cache(proj)
+        cache.get(proj)
+        attached = cache._attached_cons
+
+        # A journal coming and going changes the directory's mtime.
+        journal = cache.write_path + '-journal'
+        open(journal, 'w').close()
+        os.unlink(journal)
+        mtime = os.path.getmtime(cache.cache_dir) + 10
+        os.utime(cache.cache_dir, (mtime, mtime))
+        cache.get(proj)
+        self.assertIs(cache._attached_cons, attached)
+
+        # A new cache does not.
+        other = sgfs.path_cache(proj, name='600-journals')
+        os.utime(cache.cache_dir, (mtime + 10, mtime + 10))
+        cache.get(proj)
+        self.assertIsNot(cache._attached_cons, attached)
+        self.assertIn(other.write_path, cache.read_paths)
+
+    def test_journal_mode_is_left_alone(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        # Someone else's cache, which may be shared over NFS.
+        path = os.path.join(root, '.sgfs', 'caches', '600-shared.v2.sqlite')
+        con = sqlite3.connect(path)
+        con.execute("""CREATE TABLE entity_paths (entity_type TEXT, entity_id INTEGER, path TEXT,
+            parent TEXT, depth INTEGER, tag TEXT, tag_fingerprint TEXT, tag_complete INTEGER)""")
+        con.commit()
+        con.close()
+
+        cache = sgfs.path_cache(proj, name='600-shared')
+        cache[sgfs.session.merge(self.fix.Sequence('Shared', project=proj))] = os.path.join(root, 'SEQ', 'Shared')
+
+        con = sqlite3.connect(path)
+        self.assertEqual(con.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+        con.close()
+
+    def test_path_caches_are_memoized(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+
+        cache = sgfs.path_cache(proj)
+        constructed = sgfs.stats['path_cache.constructed']
+        for i in range(10):
+            self.assertIs(sgfs.path_cache(proj), cache)
+            self.assertIs(sgfs.path_cache(sgfs.project_roots[proj]), cache)
+        self.assertEqual(constructed, sgfs.stats['path_cache.constructed'])
+
+        # A new cache file in the directory is picked up without rebuilding it.
+        other = sgfs.path_cache(proj, name='600-test')
+        mtime = os.path.getmtime(cache.cache_dir) + 10
+        os.utime(cache.cache_dir, (mtime, mtime))
+        self.assertIs(sgfs.path_cache(proj), cache)
+        self.assertEqual(cache.get(proj), sgfs.project_roots[proj])
+        self.assertIn(other.write_path, cache.read_paths)
+        self.assertEqual(constructed + 1, sgfs.stats['path_cache.constructed'])
+
+    def test_connections_are_pooled(self):
+
+        from sgfs.cache import connection_pool
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+
+        cache = sgfs.path_cache(proj)
+        cache.get(proj)
+        before = connection_pool.open_count
+
+        for i in range(10):
+            cache = sgfs.path_cache(proj)
+            self.assertEqual(1, len(cache))
+            self.assertEqual(cache.get(proj), sgfs.project_roots[proj])
+
+        self.assertEqual(before, connection_pool.open_count)
+
+    def test_connection_pool_is_bounded(self):
+
+        from sgfs.cache import ConnectionPool
+
+        paths = [os.path.join(self.sandbox, 'pool.%d.sqlite' % i) for i in range(3)]
+        for path in paths:
+            open(path, 'w').close()
+
+        pool = ConnectionPool(enabled=True, max_size=2)
+        cons = [pool.connect(path) for path in paths]
+        self.assertIsNone(cons[0].con)
+        self.assertIsNotNone(cons[2].con)
+
+        # Evicted connections still work for anyone holding onto them.
+        with cons[0] as con:
+            con.execute('CREATE TABLE IF NOT EXISTS test (value TEXT)')
+        pool.close()
+
+    def test_walk_directory_stops_at_separators(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+        cache = sgfs.path_cache(proj)
+
+        seqs = {}
+        for code in ('GC', 'GC2', 'GC-x', 'GC/010'):
+            seq = sgfs.session.merge(self.fix.Sequence(code, project=proj))
+            cache[seq] = os.path.join(root, 'SEQ', code)
+            seqs[code] = seq
+
+        found = sorted(os.path.relpath(path, root) for path, entity in cache.walk_directory(os.path.join(root, 'SEQ', 'GC'), must_exist=False))
+        self.assertEqual(found, ['SEQ/GC', 'SEQ/GC/010'])
+
+        found = list(cache.walk_directory(root, must_exist=False))
+        self.assertEqual(len(found), 5)
+
+    def test_walk_directory_max_depth(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        # An old cache, without parents or depths.
+        con = sqlite3.connect(os.path.join(root, '.sgfs', 'caches', '100-old.sqlite'))
+        con.execute('CREATE TABLE entity_paths (entity_type TEXT, entity_id INTEGER, path TEXT)')
+        con.execute("INSERT INTO entity_paths VALUES ('Task', 1234, 'SEQ/GC/GC_001/Old')")
+        con.commit()
+        con.close()
+
+        cache = sgfs.path_cache(proj)
+        for rel_path in ('SEQ/GC', 'SEQ/GC/GC_001', 'SEQ/GC/GC_001/Anm', 'SEQ/GC/GC_001/Anm/v001', 'SEQ/GC2/GC2_001'):
+            entity = sgfs.session.merge(self.fix.PublishEvent(rel_path, project=proj))
+            cache[entity] = os.path.join(root, rel_path)
+
+        def find(path, max_depth):
+            return sorted(os.path.relpath(x, root) for x, entity in sgfs.entities_in_directory(os.path.join(root, path), max_depth=max_depth))
+
+        for path in ('SEQ/GC/GC_001/Anm/v001', 'SEQ/GC/GC_001/Old', 'SEQ/GC2/GC2_001'):
+            os.makedirs(os.path.join(root, path))
+
+        self.assertEqual(find('SEQ/GC', 0), ['SEQ/GC'])
+        self.assertEqual(find('SEQ/GC', 1), ['SEQ/GC', 'SEQ/GC/GC_001'])
+        self.assertEqual(find('SEQ/GC', 2), ['SEQ/GC', 'SEQ/GC/GC_001', 'SEQ/GC/GC_001/Anm', 'SEQ/GC/GC_001/Old'])
+        self.assertEqual(len(find('SEQ/GC', None)), 5)
+        self.assertEqual(find('', 1), ['.'])
+        self.assertEqual(find('', 2), ['.', 'SEQ/GC'])
+
+    def test_old_caches_are_left_alone(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        # What older versions of SGFS write.
+        old_path = os.path.join(root, '.sgfs', 'caches', '500-primary.sqlite')
+        con = sqlite3.connect(old_path)
+        con.execute('CREATE TABLE entity_paths (entity_type TEXT, entity_id INTEGER, path TEXT)')
+        con.execute('CREATE UNIQUE INDEX entity_paths_entity ON entity_paths(entity_type, entity_id)')
+        con.execute("INSERT OR REPLACE into entity_paths values ('Task', 1234, 'SEQ/Old')")
+        con.commit()
+        con.close()
+
+        cache = SGFS(root=self.sandbox, shotgun=self.sg).path_cache(proj)
+        self.assertIn(old_path, cache.read_paths)
+        self.assertEqual(len(cache), 2)
+        list(cache.walk_tags(root, must_exist=False, max_depth=1))
+        cache[sgfs.session.merge(self.fix.Sequence('New', project=proj))] = os.path.join(root, 'SEQ', 'New')
+
+        # Older versions can still write to it, but it has gained the path index.
+        con = sqlite3.connect(old_path)
+        self.assertEqual(len(con.execute('PRAGMA table_info(entity_paths)').fetchall()), 3)
+        self.assertIn('entity_paths_path', [row[1] for row in con.execute('PRAGMA index_list(entity_paths)')])
+        con.execute("INSERT OR REPLACE into entity_paths values ('Task', 1235, 'SEQ/Older')")
+        con.commit()
+        con.close()
+
+        # Ours is read first.
+        self.assertEqual(cache.read_paths.index(cache.write_path) + 1, cache.read_paths.index(old_path))
+
+    def test_old_caches_are_replaced(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        old_path = os.path.join(root, '.sgfs', 'caches', '500-primary.sqlite')
+        con = sqlite3.connect(old_path)
+        con.execute('CREATE TABLE entity_paths (entity_type TEXT, entity_id INTEGER, path TEXT)')
+        con.execute("INSERT INTO entity_paths VALUES ('Task', 1234, 'SEQ/Old')")
+        con.commit()
+        con.close()
+
+        # Moving it is written to our cache, and the old row is now stale.
+        cache = SGFS(root=self.sandbox, shotgun=self.sg).path_cache(proj)
+        task = cache.sgfs.session.merge(dict(type='Task', id=1234))
+        cache[task] = os.path.join(root, 'Other', 'New')
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(len(list(cache)), 2)
+        self.assertEqual(list(cache.walk_directory(os.path.join(root, 'SEQ'), must_exist=False)), [])
+        self.assertEqual(list(cache.walk_directory(os.path.join(root, 'Other'), must_exist=False)), [
+            (os.path.join(root, 'Other', 'New'), task),
+        ])
+
+    def test_reverse_lookups_on_old_caches(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        pub = sgfs.session.merge(self.fix.PublishEvent('Old', project=proj))
+        pub_path = os.path.join(root, 'SEQ', 'Old')
+        os.makedirs(pub_path)
+        sgfs.tag_directory_with_entity(pub_path, pub, cache=False)
+
+        old_path = os.path.join(root, '.sgfs', 'caches', '100-old.sqlite')
+        con = sqlite3.connect(old_path)
+        con.execute('CREATE TABLE entity_paths (entity_type TEXT, entity_id INTEGER, path TEXT)')
+        con.execute('INSERT INTO entity_paths VALUES (?, ?, ?)', (pub['type'], pub['id'], 'SEQ/Old'))
+        con.commit()
+        con.close()
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        cache = sgfs.path_cache(proj)
+        self.assertEqual(len(cache.entities_at_paths([pub_path])), 1)
+        self.assertSameEntity(sgfs.entity_from_path(pub_path), pub)
+
+        # It was indexed, so it isn't scanned.
+        con = sqlite3.connect(old_path)
+        plan = con.execute('EXPLAIN QUERY PLAN SELECT * FROM entity_paths WHERE path IN (?, ?)', ('a', 'b')).fetchall()
+        con.close()
+        self.assertIn('entity_paths_path', ' '.join(str(row[-1]) for row in plan))
+
+        # One we couldn't index isn't consulted; we still find it by walking.
+        cache._path_indexed[old_path] = False
+        sgfs.clear_lookup_cache()
+        self.assertEqual(cache.entities_at_paths([pub_path]), {})
+        self.assertSameEntity(sgfs.entity_from_path(pub_path), pub)
+
+    def test_batched_writes(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+        cache = sgfs.path_cache(proj)
+
+        def count_written():
+            with cache.write_con() as con:
+                return con.execute('SELECT COUNT(1) FROM entity_paths').fetchone()[0]
+
+        pubs = []
+        with cache.batch():
+            for i in range(5):
+                pub = sgfs.session.merge(self.fix.PublishEvent('Publish %d' % i, project=proj))
+                pub_dir = os.path.join(root, 'Publish %d' % i)
+                os.makedirs(pub_dir)
+                sgfs.tag_directory_with_entity(pub_dir, pub, cache=False)
+                cache[pub] = pub_dir
+                pubs.append((pub, pub_dir))
+                self.assertEqual(cache.get(pub), pub_dir)
+            self.assertEqual(1, count_written())
+
+        self.assertEqual(6, count_written())
+        for pub, pub_dir in pubs:
+            self.assertEqual(cache.get(pub), pub_dir)
+
+        # Still written if something goes wrong.
+        pub = sgfs.session.merge(self.fix.PublishEvent('Failed', project=proj))
+        try:
+            with sgfs.batch_path_caches():
+                sgfs.path_cache(proj)[pub] = root
+                raise ValueError('something went wrong')
+        except ValueError:
+            pass
+        self.assertEqual(7, count_written())
+
+        # One cache failing to commit doesn't lose the writes to the others.
+        other_proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(other_proj, allow_project=True)
+        other = sgfs.path_cache(other_proj)
+        def fail():
+            raise sqlite3.OperationalError('database is locked')
+        other._commit_batch = fail
+        pub = sgfs.session.merge(self.fix.PublishEvent('Locked', project=proj))
+        with capture_logs(silent=True):
+            with self.assertRaises(sqlite3.OperationalError):
+                with sgfs.batch_path_caches():
+                    other[sgfs.session.merge(self.fix.PublishEvent('Other', project=other_proj))] = sgfs.path_for_entity(other_proj)
+                    cache[pub] = root
+        self.assertEqual(8, count_written())
+
+    def test_rebuild_cache_with_jobs(self):
+
+        from sgfs.walk import walk_directory_tags
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        pubs = []
+        for i in range(10):
+            pub = sgfs.session.merge(self.fix.PublishEvent('Publish %d' % i, project=proj))
+            pub_dir = os.path.join(root, 'Deep', str(i % 3), 'Publish %d' % i)
+            os.makedirs(pub_dir)
+            sgfs.tag_directory_with_entity(pub_dir, pub, cache=False)
+            pubs.append((pub, pub_dir))
+
+        serial = sorted(path for path, tags in walk_directory_tags(sgfs, root))
+        threaded = sorted(path for path, tags in walk_directory_tags(sgfs, root, jobs=4))
+        self.assertEqual(serial, threaded)
+        self.assertEqual(len(serial), 11)
+
+        changed = sgfs.rebuild_cache(root, recurse=True, jobs=4)
+        self.assertEqual(len(changed), 10)
+        for pub, pub_dir in pubs:
+            self.assertEqual(sgfs.path_for_entity(pub), pub_dir)
+
+    def test_tags_are_cached(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        pub = sgfs.session.merge(self.fix.PublishEvent('Cached', project=proj))
+        pub_dir = os.path.join(root, 'Cached')
+        os.makedirs(pub_dir)
+        sgfs.tag_directory_with_entity(pub_dir, pub)
+
+        # A fresh SGFS gets the tag without reading the directory.
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        tags = [tag for path, tag in sgfs.entity_tags_in_directory(pub_dir)]
+        self.assertEqual(len(tags), 1)
+        self.assertEqual(tags[0]['entity']['code'], pub['code'])
+        self.assertEqual(sgfs.stats['path_cache.tag_hit'], 1)
+        self.assertEqual(sgfs.stats['tag_cache.miss'], 0)
+
+        # The tag files are still the source of truth.
+        raw_tags = sgfs._read_directory_tags(pub_dir)
+        raw_tags[0]['entity']['code'] = 'Changed'
+        sgfs._write_directory_tags(pub_dir, raw_tags, replace=True, backup=False)
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        tags = [tag for path, tag in sgfs.entity_tags_in_directory(pub_dir)]
+        self.assertEqual(tags[0]['entity']['code'], 'Changed')
+        self.assertEqual(sgfs.stats['path_cache.tag_miss'], 1)
+
+        # Until they are cached again.
+        sgfs.rebuild_cache(pub_dir)
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        entities = [entity for path, entity in sgfs.entities_in_directory(pub_dir, load_tags=True)]
+        self.assertEqual(entities[0]['code'], 'Changed')
+        self.assertEqual(sgfs.stats['path_cache.tag_hit'], 1)
+
+    def test_tags_are_verified_by_stat(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        pub = sgfs.session.merge(self.fix.PublishEvent('Verified', project=proj))
+        pub_dir = os.path.join(root, 'Verified')
+        os.makedirs(pub_dir)
+        sgfs.tag_directory_with_entity(pub_dir, pub)
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        pub = sgfs.session.merge(pub.minimal)
+        self.assertEqual(sgfs.path_cache(proj).get(pub), pub_dir)
+        self.assertEqual(sgfs.stats['path_cache.stat_verified'], 1)
+        self.assertEqual(sgfs.stats['tag_cache.miss'], 0)
+
+        # Copies are not relinked, since the original is still tagged.
+        copy_dir = os.path.join(root, 'Copied')
+        check_call(['cp', '-rp', pub_dir, copy_dir])
+        self.assertEqual(sgfs.rebuild_cache(copy_dir), [])
+        self.assertEqual(sgfs.path_cache(proj).get(pub), pub_dir)
+        self.assertEqual(sgfs.stats['path_cache.tag_verified'], 0)
+
+        # Moves are.
+        os.rename(pub_dir, pub_dir + '.moved')
+        changed = sgfs.rebuild_cache(copy_dir)
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(sgfs.path_cache(proj).get(pub), copy_dir)
+
+    def test_verification_policy(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Test Project ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        root = sgfs.path_for_entity(proj)
+
+        pub = sgfs.session.merge(self.fix.PublishEvent('Trusted', project=proj))
+        pub_dir = os.path.join(root, 'Trusted')
+        os.makedirs(pub_dir)
+        sgfs.tag_directory_with_entity(pub_dir, pub)
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg, verify_tags='60')
+        pub = sgfs.session.merge(pub.minimal)
+        cache = sgfs.path_cache(proj)
+        for i in range(3):
+            self.assertEqual(cache.get(pub), pub_dir)
+        self.assertEqual(sgfs.stats['path_cache.stat_verified'], 1)
+        self.assertEqual(sgfs.stats['path_cache.verify_skipped'], 2)
+
+        # We trust it until the verification expires.
+        os.unlink(os.path.join(pub_dir, '.sgfs.yml'))
+        self.assertEqual(cache.get(pub), pub_dir)
+        sgfs.clear_tag_cache()
+        with capture_logs(silent=True):
+            self.assertEqual(cache.get(pub), None)
+
+        sgfs.verify_max_age = None
+        self.assertEqual(cache.get(pub), pub_dir)
+
+        # Turning off the tag cache doesn't turn off the policy.
+        sgfs.tag_directory_with_entity(pub_dir, pub)
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg, verify_tags='60', tag_cache_size=0)
+        pub = sgfs.session.merge(pub.minimal)
+        cache = sgfs.path_cache(proj)
+        for i in range(3):
+            self.assertEqual(cache.get(pub), pub_dir)
+        self.assertEqual(sgfs.stats['path_cache.verify_skipped'], 2)
+
+        self.assertRaises(ValueError, SGFS, root=self.sandbox, shotgun=self.sg, verify_tags='sometimes')
+
+        # An explicit 0 is "always", whatever the environment says.
+        os.environ['SGFS_VERIFY_TAGS'] = 'never'
+        try:
+            self.assertEqual(SGFS(root=self.sandbox, shotgun=self.sg, verify_tags=0).verify_max_age, 0)
+        finally:
+            del os.environ['SGFS_VERIFY_TAGS']
+
 
 
 
@@ -138,7 +638,7 @@ class TestOldCacheLocations(TestCase):
 
     def assert_readable_path(self, name):
         check_call(['mv', 
-            os.path.join(self.root, '.sgfs/caches/500-primary.sqlite'),
+            os.path.join(self.root, '.sgfs/caches/500-primary.v2.sqlite'),
             os.path.join(self.root, name),
         ])
         cache = self.sgfs.path_cache(self.project)
@@ -0,0 +1,54 @@
+import stat
+from subprocess import list2cmdline
+
+from common import *
+
+from sgfs.processor import Processor
+
+
+class TestProcessor(TestCase):
+
+    def test_touch(self):
+
+        path = os.path.join(self.sandbox, 'touched')
+        processor = Processor()
+        processor.touch(path)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0666)
+        self.assertEqual(processor.log_events, [list2cmdline(['touch', path])])
+
+    def test_copy(self):
+
+        source = os.path.join(self.sandbox, 'source')
+        with open(source, 'w') as fh:
+            fh.write('source')
+        os.utime(source, (1000000000, 1000000000))
+
+        dest = os.path.join(self.sandbox, 'dest')
+        processor = Processor()
+        processor.copy(source, dest, mode=0644)
+        self.assertEqual(open(dest).read(), 'source')
+        self.assertEqual(os.path.getmtime(dest), 1000000000)
+        self.assertEqual(stat.S_IMODE(os.stat(dest).st_mode), 0644)
+        self.assertEqual(processor.log_events, [list2cmdline(['cp', '-np', source, dest])])
+
+        # It won't clobber.
+        existing = os.path.join(self.sandbox, 'existing')
+        with open(existing, 'w') as fh:
+            fh.write('existing')
+        os.chmod(existing, 0600)
+        processor.copy(source, existing)
+        self.assertEqual(open(existing).read(), 'existing')
+        self.assertEqual(stat.S_IMODE(os.stat(existing).st_mode), 0666)
+
+    def test_dry_run(self):
+
+        path = os.path.join(self.sandbox, 'dry_run')
+        processor = Processor(dry_run=True)
+        processor.touch(path)
+        processor.copy(path, path + '.copy')
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(processor.log_events, [
+            list2cmdline(['touch', path]),
+            list2cmdline(['cp', '-np', path, path + '.copy']),
+        ])
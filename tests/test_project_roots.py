@@ -1,3 +1,5 @@
+import time
+
 from common import *
 
 
@@ -47,3 +49,82 @@ class TestMultipleProjects(TestCase):
         sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
         self.assertEqual(4, len(sgfs.project_roots))
         
+
+
+class TestProjectIndex(TestCase):
+
+    def setUp(self):
+        sg = Shotgun()
+        self.sg = self.fix = fix = Fixture(sg)
+
+    def test_index_is_used(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        for i in range(1, 4):
+            proj = sgfs.session.merge(self.fix.Project(('Test Project %d ' % i) + mini_uuid()))
+            sgfs.create_structure(proj, allow_project=True)
+
+        # Build the index, and pretend that happened a while ago.
+        roots = SGFS(root=self.sandbox, shotgun=self.sg).project_roots
+        self.assertEqual(3, len(roots))
+        mtime = time.time() - 60
+        os.utime(self.sandbox, (mtime, mtime))
+        SGFS(root=self.sandbox, shotgun=self.sg).project_roots
+
+        # Nothing is read with an up to date index.
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        self.assertEqual(sorted(sgfs.project_roots.values()), sorted(roots.values()))
+        self.assertEqual(sgfs.stats['project_index.hit'], 1)
+        self.assertEqual(sgfs.stats['tag_cache.miss'], 0)
+
+        # Only the new project is read once the root changes.
+        proj = sgfs.session.merge(self.fix.Project('Test Project 4 ' + mini_uuid()))
+        sgfs.create_structure(proj, allow_project=True)
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        self.assertEqual(4, len(sgfs.project_roots))
+        self.assertEqual(sgfs.stats['project_index.update'], 1)
+        self.assertEqual(sgfs.stats['project_index.read'], 1)
+
+    def test_tagging_existing_directory(self):
+
+        path = os.path.join(self.sandbox, 'Existing_' + mini_uuid())
+        os.makedirs(path)
+
+        # Build the index, and pretend that happened a while ago.
+        SGFS(root=self.sandbox, shotgun=self.sg).project_roots
+        mtime = int(time.time()) - 60
+        os.utime(self.sandbox, (mtime, mtime))
+        before = len(SGFS(root=self.sandbox, shotgun=self.sg).project_roots)
+
+        # This doesn't change the root, but the index must still see it.
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        proj = sgfs.session.merge(self.fix.Project('Existing ' + mini_uuid()))
+        sgfs.tag_directory_with_entity(path, proj, cache=False)
+        self.assertEqual(os.stat(self.sandbox).st_mtime, mtime)
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        self.assertEqual(len(sgfs.project_roots), before + 1)
+        self.assertEqual(sgfs.project_roots[sgfs.session.merge(proj.minimal)], os.path.abspath(path))
+        self.assertEqual(sgfs.stats['project_index.update'], 1)
+        self.assertEqual(sgfs.stats['project_index.read'], 1)
+
+    def test_find_project_root(self):
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        name = 'Prefix ' + mini_uuid()
+        foo = sgfs.session.merge(self.fix.Project(name))
+        foobar = sgfs.session.merge(self.fix.Project(name + ' Bar'))
+        sgfs.create_structure([foo, foobar], allow_project=True)
+        foo_root = sgfs.path_for_entity(foo)
+        foobar_root = sgfs.path_for_entity(foobar)
+        os.symlink(foo_root, os.path.join(self.sandbox, 'alias'))
+
+        sgfs = SGFS(root=self.sandbox, shotgun=self.sg)
+        foo = sgfs.session.merge(foo.minimal)
+        foobar = sgfs.session.merge(foobar.minimal)
+
+        self.assertEqual(sgfs.find_project_root(foo_root), (foo, foo_root))
+        self.assertEqual(sgfs.find_project_root(os.path.join(foobar_root, 'SEQ')), (foobar, os.path.join(foobar_root, 'SEQ')))
+        self.assertEqual(sgfs.find_project_root(os.path.join(self.sandbox, 'alias', 'SEQ')), (foo, os.path.join(foo_root, 'SEQ')))
+        self.assertEqual(sgfs.find_project_root(self.sandbox), (None, os.path.abspath(self.sandbox)))
+        self.assertEqual(sgfs.path_cache(os.path.join(foobar_root, 'SEQ')).project_root, foobar_root)
@@ -1,3 +1,5 @@
+import shutil
+
 from common import *
 
 
@@ -51,4 +53,58 @@ class TestSchema(TestCase):
         self.assertEqual(stask.entity_type, 'Task')
         self.assertEqual(len(stask.children), 0)
 
-        
\ No newline at end of file
+        
+
+    def test_load_is_cached(self):
+
+        root = os.path.join(self.sandbox, 'schema')
+        shutil.copytree(schema_path, root)
+
+        schema = Schema.load(root)
+        self.assertIs(Schema.load(root), schema)
+        self.assertEqual(len(schema.children['Sequence'].children['Shot'].children), 1)
+
+        # Touching any config reloads it.
+        path = os.path.join(root, 'Shot.yml')
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+        reloaded = Schema.load(root)
+        self.assertIsNot(reloaded, schema)
+        self.assertIs(Schema.load(root), reloaded)
+
+        # As does adding a default template.
+        os.makedirs(os.path.join(root, 'Asset'))
+        self.assertIsNot(Schema.load(root), reloaded)
+
+    def test_scan_template(self):
+
+        from sgfs.structure import scan_template, TemplateCache
+
+        template = os.path.join(self.sandbox, 'template')
+        os.makedirs(os.path.join(template, 'dir'))
+        for name in ('file.txt', 'scratch.tmp', '._resource'):
+            open(os.path.join(template, name), 'w').close()
+        with open(os.path.join(template, '.sgfs-ignore'), 'w') as fh:
+            fh.write('# Comment\n*.tmp\n')
+
+        configs, dependencies = scan_template(template)
+        self.assertEqual([(c['name'], c['type']) for c in configs], [('dir', 'directory'), ('file.txt', 'file')])
+        self.assertIn(os.path.join(template, '.sgfs-ignore'), [path for path, _ in dependencies])
+
+        templates = TemplateCache()
+        self.assertIs(templates.scan(template), templates.scan(template))
+
+    def test_scanned_templates_reload_schema(self):
+
+        root = os.path.join(self.sandbox, 'schema')
+        shutil.copytree(schema_path, root)
+
+        schema = Schema.load(root)
+        template = os.path.join(root, 'Shot')
+        schema.templates.scan(template)
+        self.assertIs(Schema.load(root), schema)
+
+        os.makedirs(os.path.join(template, 'New'))
+        mtime = os.path.getmtime(template) + 10
+        os.utime(template, (mtime, mtime))
+        self.assertIsNot(Schema.load(root), schema)
@@ -84,7 +84,7 @@ class PathTester(object):
         self.assertMatches(1, r'/SEQ/')
         self.assertMatches(1, r'/\.sgfs/')
         self.assertMatches(1, r'/\.sgfs/caches/')
-        self.assertMatches(1, r'/\.sgfs/caches/[\w-]+\.sqlite')
+        self.assertMatches(1, r'/\.sgfs/caches/[\w.-]+\.sqlite')
         self.assertMatches(1, r'/\.sgfs\.yml')
     
     def assertAssetType(self, count):
@@ -195,6 +195,18 @@ class TestFullStructure(Base):
         paths = self.pathTester()
         paths.assertFullStructure()
 
+class TestConcurrentStructure(Base):
+
+    def test_concurrent_structure(self):
+        self.create(self.tasks + self.assets, allow_project=True, jobs=8)
+        paths = self.pathTester()
+        paths.assertFullStructure()
+
+        root = os.path.join(self.sandbox, self.proj_name.replace(' ', '_'))
+        self.assertEqual(2, len(self.sgfs.get_directory_entity_tags(root + '/SEQ/AA/AA_001/Model')))
+        for task in self.tasks:
+            self.assertIsNotNone(self.sgfs.path_for_entity(task))
+
 class TestIncrementalStructure(Base):
           
     def test_incremental_structure(self):
@@ -288,6 +300,42 @@ class TestMutatedStructure(Base):
         self.assertSameEntity(tags[0]['entity'], self.shots[3])
 
 
+class TestPrunedRebuild(Base):
+
+    def test_pruned_rebuild(self):
+
+        self.create(self.tasks + self.assets, allow_project=True)
+        root = os.path.join(self.sandbox, self.proj_name.replace(' ', '_'))
+        task_root = root + '/SEQ/AA/AA_001/Comp'
+
+        # Something tagged where a template points, and something which is not.
+        os.makedirs(task_root + '/published/render/v0001')
+        pub = self.session.merge(self.fix.PublishEvent('Publish', project=self.proj))
+        self.sgfs.tag_directory_with_entity(task_root + '/published/render/v0001', pub, cache=False)
+        os.makedirs(task_root + '/nuke/renders/elements/v0001/exr')
+        rogue = self.session.merge(self.fix.PublishEvent('Rogue', project=self.proj))
+        self.sgfs.tag_directory_with_entity(task_root + '/nuke/renders/elements/v0001', rogue, cache=False)
+
+        before = self.sgfs.stats['walk.pruned']
+        changed = self.sgfs.rebuild_cache(root, recurse=True, prune=True, jobs=4)
+        self.assertTrue(self.sgfs.stats['walk.pruned'] > before)
+        self.assertEqual([x[1] for x in changed], [task_root + '/published/render/v0001'])
+
+        changed = self.sgfs.rebuild_cache(root, recurse=True)
+        self.assertEqual([x[1] for x in changed], [task_root + '/nuke/renders/elements/v0001'])
+
+    def test_prune_without_schema(self):
+
+        self.create(self.tasks + self.assets, allow_project=True)
+        root = os.path.join(self.sandbox, self.proj_name.replace(' ', '_'))
+
+        # Pruning falls back to walking everything.
+        self.sgfs.schema_name = os.path.join(self.sandbox, 'no-such-schema')
+        before = self.sgfs.stats['walk.pruned']
+        self.assertEqual(self.sgfs.rebuild_cache(root, recurse=True, prune=True), [])
+        self.assertEqual(self.sgfs.stats['walk.pruned'], before)
+
+
 class TestDryRun(Base):
     
     def test_dry_run(self):
@@ -1,3 +1,5 @@
+import time
+
 from common import *
 
 
@@ -56,6 +58,165 @@ class TestTags(TestCase):
         self.assertIn('key', tags[1])
         
     
+    def test_legacy_python_yaml(self):
+
+        from sgfs.tags import load_yaml_tags
+
+        tags = load_yaml_tags('''---
+created_at: 2014-01-02 03:04:05
+entity: !!python/object/new:sgsession.entity.Entity
+    dictitems:
+        id: 123
+        type: Shot
+        code: !!python/unicode 'AA_001'
+path: /path/to/shot
+path_history: !!python/tuple
+-   path: /old/path
+    updated_at: 2013-01-02 03:04:05
+''')
+        self.assertEqual(len(tags), 1)
+        tag = tags[0]
+        self.assertEqual(tag['created_at'], datetime.datetime(2014, 1, 2, 3, 4, 5))
+        self.assertEqual(tag['entity'], {'type': 'Shot', 'id': 123, 'code': 'AA_001'})
+        self.assertIs(type(tag['entity']), dict)
+        self.assertEqual(tag['path_history'][0]['path'], '/old/path')
+
+    def test_convert_legacy_tuples(self):
+
+        from sgfs.commands.convert_tags import ConvertTags
+
+        path = os.path.join(self.sandbox, 'test_convert_legacy_tuples')
+        os.makedirs(path)
+        with open(os.path.join(path, '.sgfs.yml'), 'w') as fh:
+            fh.write('''---
+created_at: 2014-01-02 03:04:05
+entity: {type: Shot, id: 123}
+path: /path/to/shot
+path_history: !!python/tuple
+-   path: /old/path
+    updated_at: 2013-01-02 03:04:05
+''')
+
+        cmd = ConvertTags()
+        cmd.format = 'jsonl'
+        cmd.roots = [path]
+        cmd.recurse = cmd.dry_run = False
+        cmd.verbose = 0
+        cmd.backup = True
+        cmd.run()
+
+        self.assertFalse(os.path.exists(os.path.join(path, '.sgfs.yml')))
+        tags = SGFS(root=self.sandbox, session=self.session).get_directory_entity_tags(path, merge_into_session=False)
+        self.assertEqual(tags[0]['path_history'][0]['path'], '/old/path')
+
+    def test_json_tags_match_yaml_tags(self):
+
+        proj = self.fix.Project(self.project_name())
+        seq = self.session.merge(proj.Sequence('JSON'))
+
+        results = []
+        for format in ('yml', 'jsonl'):
+
+            sgfs = SGFS(root=self.sandbox, session=self.session, tag_format=format)
+            path = os.path.join(self.sandbox, 'test_json_tags', format)
+            os.makedirs(path)
+
+            sgfs.tag_directory_with_entity(path, seq, {'key': 'first', 'when': datetime.datetime(2014, 1, 2, 3, 4, 5, 6)}, cache=False)
+            sgfs.tag_directory_with_entity(path, seq, {'key': 'second', 'due': '2014-01-02'}, cache=False)
+            self.assertTrue(os.path.exists(os.path.join(path, '.sgfs.' + format)))
+
+            tags = sgfs.get_directory_entity_tags(path, allow_duplicates=True, merge_into_session=False)
+            for tag in tags:
+                tag.pop('path')
+            results.append(tags)
+
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][0]['when'], datetime.datetime(2014, 1, 2, 3, 4, 5, 6))
+        self.assertEqual(results[0][1]['due'], '2014-01-02')
+
+    def test_mixed_tag_formats(self):
+
+        proj = self.fix.Project(self.project_name())
+        seq = self.session.merge(proj.Sequence('Mixed'))
+
+        path = os.path.join(self.sandbox, 'test_mixed_tag_formats')
+        os.makedirs(path)
+
+        SGFS(root=self.sandbox, session=self.session, tag_format='yml').tag_directory_with_entity(path, seq, {'key': 'first'}, cache=False)
+        sgfs = SGFS(root=self.sandbox, session=self.session, tag_format='jsonl')
+        sgfs.tag_directory_with_entity(path, seq, {'key': 'second'}, cache=False)
+
+        tags = sgfs.get_directory_entity_tags(path, allow_duplicates=True)
+        self.assertEqual([x['key'] for x in tags], ['first', 'second'])
+
+        # Replacing moves them all into the preferred format.
+        sgfs._write_directory_tags(path, sgfs._read_directory_tags(path), replace=True)
+        self.assertFalse(os.path.exists(os.path.join(path, '.sgfs.yml')))
+        tags = sgfs.get_directory_entity_tags(path, allow_duplicates=True)
+        self.assertEqual([x['key'] for x in tags], ['first', 'second'])
+
+    def test_tag_cache(self):
+
+        proj = self.fix.Project(self.project_name())
+        seq = self.session.merge(proj.Sequence('Cached'))
+
+        path = os.path.join(self.sandbox, 'test_tag_cache')
+        os.makedirs(path)
+
+        self.sgfs.tag_directory_with_entity(path, seq, cache=False)
+        misses = self.sgfs.stats['tag_cache.miss']
+
+        tags = self.sgfs.get_directory_entity_tags(path)
+        self.assertEqual(len(tags), 1)
+        tags[0]['mutated'] = True
+        tags = self.sgfs.get_directory_entity_tags(path)
+        self.assertEqual(len(tags), 1)
+        self.assertNotIn('mutated', tags[0])
+        self.assertEqual(self.sgfs.stats['tag_cache.miss'], misses + 1)
+        self.assertTrue(self.sgfs.stats['tag_cache.hit'])
+
+        # Writing new tags must invalidate the cache.
+        self.sgfs.tag_directory_with_entity(path, seq, {'key': 'value'}, cache=False)
+        tags = self.sgfs.get_directory_entity_tags(path)
+        self.assertEqual(tags[0].get('key'), 'value')
+        self.assertEqual(self.sgfs.stats['tag_cache.miss'], misses + 2)
+
+    def test_untagged_cache(self):
+
+        proj = self.fix.Project(self.project_name())
+        seq = self.session.merge(proj.Sequence('Untagged'))
+
+        path = os.path.join(self.sandbox, 'test_untagged_cache')
+        os.makedirs(path)
+        mtime = time.time() - 60
+        os.utime(path, (mtime, mtime))
+
+        for i in range(3):
+            self.assertEqual(self.sgfs.get_directory_entity_tags(path), [])
+        self.assertEqual(self.sgfs.stats['untagged_cache.hit'], 2)
+
+        # Tagging it from elsewhere changes the mtime.
+        SGFS(root=self.sandbox, session=self.session).tag_directory_with_entity(path, seq, cache=False)
+        self.assertEqual(len(self.sgfs.get_directory_entity_tags(path)), 1)
+
+        # As does tagging it from here.
+        path = os.path.join(self.sandbox, 'test_untagged_cache_2')
+        os.makedirs(path)
+        os.utime(path, (mtime, mtime))
+        self.assertEqual(self.sgfs.get_directory_entity_tags(path), [])
+        self.sgfs.tag_directory_with_entity(path, seq, cache=False)
+        os.utime(path, (mtime, mtime))
+        self.assertEqual(len(self.sgfs.get_directory_entity_tags(path)), 1)
+
+        # It is sized separately from the tag cache.
+        sgfs = SGFS(root=self.sandbox, session=self.session, tag_cache_size=0)
+        path = os.path.join(self.sandbox, 'test_untagged_cache_3')
+        os.makedirs(path)
+        os.utime(path, (mtime, mtime))
+        for i in range(3):
+            self.assertEqual(sgfs.get_directory_entity_tags(path), [])
+        self.assertEqual(sgfs.stats['untagged_cache.hit'], 2)
+
     def test_from_paths(self):
         
         proj = self.fix.Project(self.project_name())
@@ -82,10 +243,147 @@ class TestTags(TestCase):
         seqs = self.sgfs.entities_from_path(shot_path, entity_type='Sequence')
         self.assertEqual(len(seqs), 1)
         self.assertSameEntity(seqs[0], seq)
-        
-        
-        
-        
+
+    def test_from_paths_below_cache(self):
+
+        proj = self.session.merge(self.fix.Project(self.project_name()))
+        seq = proj.Sequence('Sequence')
+        shot = self.session.merge(seq.Shot('Shot'))
+        task = self.session.merge(shot.Task('Task'))
+
+        self.sgfs.create_structure(proj, allow_project=True)
+        proj_path = self.sgfs.path_for_entity(proj)
+        shot_path = os.path.join(proj_path, 'shot')
+        task_path = os.path.join(shot_path, 'task')
+        other_path = os.path.join(proj_path, 'other')
+        os.makedirs(task_path)
+        os.makedirs(other_path)
+
+        # The shot is cached, but the task under it is not.
+        self.sgfs.tag_directory_with_entity(shot_path, shot)
+        self.sgfs.tag_directory_with_entity(task_path, task, cache=False)
+        tasks = self.sgfs.entities_from_path(task_path)
+        self.assertEqual(len(tasks), 1)
+        self.assertSameEntity(tasks[0], task)
+
+        # The task is cached, but somewhere else.
+        self.sgfs.tag_directory_with_entity(other_path, task)
+        self.sgfs.clear_lookup_cache()
+        tasks = self.sgfs.entities_from_path(task_path)
+        self.assertEqual(len(tasks), 1)
+        self.assertSameEntity(tasks[0], task)
+
+        ctx = self.sgfs.context_from_path(task_path)
+        self.assertSameEntity(ctx.entity, proj)
+        self.assertSameEntity(ctx.linear_base[-1].entity, task)
+
+    def test_from_paths_with_stale_cache(self):
+
+        proj = self.session.merge(self.fix.Project(self.project_name()))
+        seq = self.session.merge(proj.Sequence('Sequence'))
+        shot = self.session.merge(seq.Shot('Shot'))
+        task = self.session.merge(shot.Task('Task'))
+
+        self.sgfs.create_structure(proj, allow_project=True)
+        proj_path = self.sgfs.path_for_entity(proj)
+        seq_path = os.path.join(proj_path, 'seq')
+        shot_path = os.path.join(seq_path, 'shot')
+        task_path = os.path.join(shot_path, 'task')
+        os.makedirs(task_path)
+
+        # The shot is between two cached directories, but isn't cached itself,
+        # and the task has since been untagged.
+        self.sgfs.tag_directory_with_entity(seq_path, seq)
+        self.sgfs.tag_directory_with_entity(shot_path, shot, cache=False)
+        self.sgfs.tag_directory_with_entity(task_path, task)
+        os.unlink(os.path.join(task_path, '.sgfs.yml'))
+
+        for use_cache in (True, False):
+            shots = self.sgfs.entities_from_path(task_path, use_cache=use_cache)
+            self.assertEqual(len(shots), 1)
+            self.assertSameEntity(shots[0], shot)
+            ctx = self.sgfs.context_from_path(task_path, use_cache=use_cache)
+            self.assertSameEntity(ctx.linear_base[-1].entity, shot)
+
+    def test_lookup_cache(self):
+
+        proj = self.fix.Project(self.project_name())
+        seq = proj.Sequence('Sequence')
+        shot = seq.Shot('Shot')
+
+        proj_path = os.path.join(self.sandbox, 'test_lookup_cache')
+        seq_path = os.path.join(proj_path, 'seq')
+        shot_path = os.path.join(seq_path, 'shot')
+        work_path = os.path.join(shot_path, 'work')
+        os.makedirs(work_path)
+
+        self.sgfs.tag_directory_with_entity(proj_path, self.session.merge(proj), cache=False)
+        self.sgfs.tag_directory_with_entity(seq_path, self.session.merge(seq), cache=False)
+
+        seqs = self.sgfs.entities_from_path(work_path)
+        self.assertSameEntity(seqs[0], seq)
+        seqs.append(None)
+        seqs = self.sgfs.entities_from_path(work_path)
+        self.assertEqual(len(seqs), 1)
+        self.assertEqual(self.sgfs.stats['lookup_cache.hit'], 1)
+
+        # Tagging a directory in between must invalidate it.
+        self.sgfs.tag_directory_with_entity(shot_path, self.session.merge(shot), cache=False)
+        shots = self.sgfs.entities_from_path(work_path)
+        self.assertSameEntity(shots[0], shot)
+        self.assertEqual(self.sgfs.stats['lookup_cache.hit'], 1)
+
+        # Contexts are copied, so callers can't modify the memoized one.
+        ctx = self.sgfs.context_from_path(work_path)
+        ctx.children = []
+        ctx = self.sgfs.context_from_path(work_path)
+        self.assertEqual(len(ctx.linear_base), 3)
+        self.assertEqual(self.sgfs.stats['lookup_cache.hit'], 2)
+
+        self.sgfs.clear_lookup_cache()
+        self.sgfs.context_from_path(work_path)
+        self.assertEqual(self.sgfs.stats['lookup_cache.hit'], 2)
+
+        # It is sized separately from the tag cache.
+        sgfs = SGFS(root=self.sandbox, session=self.session, tag_cache_size=0)
+        sgfs.entities_from_path(work_path)
+        sgfs.entities_from_path(work_path)
+        self.assertEqual(sgfs.stats['lookup_cache.hit'], 1)
+        sgfs = SGFS(root=self.sandbox, session=self.session, lookup_cache_size=0)
+        sgfs.entities_from_path(work_path)
+        sgfs.entities_from_path(work_path)
+        self.assertEqual(sgfs.stats['lookup_cache.hit'], 0)
+
+    def test_lookup_cache_by_mtime(self):
+
+        proj = self.fix.Project(self.project_name())
+        seq = proj.Sequence('Sequence')
+        other = proj.Sequence('Other')
+
+        proj_path = os.path.join(self.sandbox, 'test_lookup_cache_by_mtime')
+        seq_path = os.path.join(proj_path, 'seq')
+        work_path = os.path.join(seq_path, 'shot', 'work')
+        os.makedirs(work_path)
+
+        self.sgfs.tag_directory_with_entity(proj_path, self.session.merge(proj), cache=False)
+        self.sgfs.tag_directory_with_entity(seq_path, self.session.merge(seq), cache=False)
+
+        # Old enough that their mtimes are trusted.
+        mtime = int(time.time()) - 60
+        for path in self.sgfs._iter_ancestors(work_path):
+            if path.startswith(proj_path):
+                os.utime(path, (mtime, mtime))
+
+        self.assertEqual(len(self.sgfs.entities_from_path(work_path)), 1)
+        self.assertEqual(len(self.sgfs.entities_from_path(work_path)), 1)
+        self.assertEqual(self.sgfs.stats['lookup_cache.hit'], 1)
+
+        # Appending to a tag file doesn't change the directory's mtime.
+        self.sgfs.tag_directory_with_entity(seq_path, self.session.merge(other), cache=False)
+        self.assertEqual(os.stat(seq_path).st_mtime, mtime)
+        self.assertEqual(len(self.sgfs.entities_from_path(work_path)), 2)
+        self.assertEqual(self.sgfs.stats['lookup_cache.hit'], 1)
+
     def test_set_get(self):
         
         path = os.path.join(self.sandbox, 'test_set_get')
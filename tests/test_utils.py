@@ -0,0 +1,33 @@
+from common import *
+
+from sgfs import utils
+
+
+class TestExprs(TestCase):
+
+    def test_compiled_once(self):
+
+        src = 'value * 2'
+        filename = 'sgfs.test.compiled_once'
+        self.assertEqual(utils.eval_expr_or_func(src, {'value': 1}, filename=filename), 2)
+        compiled = utils._compiled_exprs.get((src, filename))
+        self.assertIsNotNone(compiled)
+        self.assertEqual(utils.eval_expr_or_func(src, {'value': 2}, filename=filename), 4)
+        self.assertIs(utils._compiled_exprs.get((src, filename)), compiled)
+
+    def test_functions_get_new_globals(self):
+
+        src = 'doubled = value * 2\nreturn doubled + 1'
+        self.assertEqual(utils.eval_expr_or_func(src, {'value': 1}), 3)
+        self.assertEqual(utils.eval_expr_or_func(src, {'value': 2}), 5)
+
+    def test_profile(self):
+
+        with utils.profile_exprs() as profile:
+            utils.eval_expr_or_func('value', {'value': 1}, filename='sgfs.test.profile')
+            utils.eval_expr_or_func('value', {'value': 2}, filename='sgfs.test.profile')
+        utils.eval_expr_or_func('value', {'value': 3}, filename='sgfs.test.profile')
+
+        count, seconds = profile[('value', 'sgfs.test.profile')]
+        self.assertEqual(count, 2)
+        self.assertTrue(seconds >= 0)